@@ -0,0 +1,34 @@
+"""
+SQLite для рабочего режима.
+
+В OPTIONS дополнительно к параметрам sqlite3.connect() принимаются:
+    pragmas - PRAGMA, выполняемые при каждом подключении (journal_mode, synchronous, busy_timeout, ...);
+    transaction_mode - режим BEGIN для transaction.atomic(): DEFERRED, IMMEDIATE или EXCLUSIVE.
+
+При BEGIN IMMEDIATE блокировка записи берется в начале транзакции, и конкурирующая запись ждет
+busy_timeout, а не получает "database is locked" при попытке повысить блокировку чтения до записи.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def get_connection_params(self):
+        kwargs = super().get_connection_params()
+        self.pragmas = kwargs.pop('pragmas', {})
+        self.transaction_mode = (kwargs.pop('transaction_mode', None) or 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(f"transaction_mode должен быть одним из {', '.join(TRANSACTION_MODES)}")
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')
@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import os
 from pathlib import Path
 from django.conf.locale.ru import formats as ru_formats
 
@@ -57,9 +58,13 @@ MIDDLEWARE = [
     'session_security.middleware.SessionSecurityMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'registry.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'polyclinic.urls'
+# Бюджеты запросов установившегося режима (кэши прав, справочника врачей и расписания заполнены)
+REGISTRY_QUERY_BUDGETS = {'appointment': 4, 'calendar': 3, 'mybooking': 4,
+                          'appointment_async': 4, 'mybooking_async': 5}
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
 SESSION_SECURITY_WARN_AFTER = 60
 SESSION_SECURITY_EXPIRE_AFTER = 120
@@ -87,17 +92,76 @@ CRISPY_TEMPLATE_PACK = 'bootstrap3'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
+# Профиль выбирается переменной окружения POLYCLINIC_DATABASE_PROFILE (по умолчанию - default).
+# production: WAL (чтение не блокирует запись), ожидание блокировки вместо "database is locked",
+# BEGIN IMMEDIATE для transaction.atomic() и постоянные подключения.
+
+DATABASE_PROFILES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'polyclinic.sqlite3',
-    }
+    },
+    'production': {
+        'ENGINE': 'polyclinic.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'polyclinic.sqlite3',
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': 20,
+            'transaction_mode': 'IMMEDIATE',
+            'pragmas': {
+                'journal_mode': 'WAL',
+                'synchronous': 'NORMAL',
+                'busy_timeout': 20000,
+                'mmap_size': 256 * 1024 * 1024,
+                'cache_size': -64 * 1024,
+                'temp_store': 'MEMORY',
+            },
+        },
+    },
+}
+
+DATABASES = {
+    'default': dict(DATABASE_PROFILES[os.environ.get('POLYCLINIC_DATABASE_PROFILE', 'default')]),
+}
+
+# Кэш, общий для всех процессов (воркеров) приложения: версии расписания, версия справочника врачей, права
+# пользователей. Таблица registry_cache создается командой migrate (createcachetable после миграций).
+# Версии записываются только при изменении данных, просмотр страниц кэш лишь читает. В эксплуатации кэш
+# можно вынести из файла базы в Redis или Memcached, чтобы записи кэша не занимали блокировку записи SQLite.
+CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'registry_cache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+REGISTRY_SCHEDULE_CACHE = 'shared'
+REGISTRY_DIRECTORY_CACHE = 'shared'
+REGISTRY_PERMISSION_CACHE = 'shared'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'require_debug_true': {'()': 'django.utils.log.RequireDebugTrue'},
+    },
+    'handlers': {
+        'queries': {'class': 'logging.StreamHandler', 'level': 'WARNING'},
+        'queries_debug': {'class': 'logging.StreamHandler', 'filters': ['require_debug_true']},
+    },
+    'loggers': {
+        'registry.queries': {'handlers': ['queries', 'queries_debug'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
+AUTHENTICATION_BACKENDS = ['registry.backends.CachedModelBackend']
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -2,12 +2,16 @@ import datetime
 from django import forms
 from django.contrib import admin, messages
 from django.contrib.auth.models import User
+from django.conf import settings
 from django.contrib.auth.admin import UserAdmin
 from django.db import IntegrityError
 from django.http import HttpResponseRedirect
 from django.urls import reverse
-from .models import Specialization, Appointment, Profile, Booking
-from .forms import AppointmentForm, ProfileForm, BookingForm
+from .models import Specialization, Appointment, Profile, Booking, Timetable, ArchivedAppointment, ArchivedBooking
+from .forms import AppointmentForm, ProfileForm, BookingForm, TimetableForm
+from . import export, slots, timetable
+from .pagination import KeysetChangeList
+from .signals import notify_schedule_changed
 
 
 class SpecializationAdmin(admin.ModelAdmin):
@@ -51,6 +55,11 @@ class AppointmentAdmin(admin.ModelAdmin):
     actions = ['create_slots', 'delete_slots']
     change_form_template = "registry_changeform.html"
     form = AppointmentForm
+    keyset = ('-dapp', '-specname_id', '-doctor_id')
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
 
     def get_actions(self, request):
         actions = super().get_actions(request)
@@ -64,35 +73,30 @@ class AppointmentAdmin(admin.ModelAdmin):
                                                                      f'{obj.profile.patronymic}'
         return form
 
-    @staticmethod
-    def time_slots(date, start_time, end_time, n):
-        delta = (datetime.datetime.combine(date, end_time) - datetime.datetime.combine(date, start_time)) / n
-        t = start_time
-        while t < end_time:
-            yield t.strftime('%H:%M')
-            t = (datetime.datetime.combine(datetime.date.today(), t) + delta).time()
-
     def create_slots(self, request, queryset):
-        for rec in queryset:
-            if not rec.is_slots:
-                for _ in range(rec.plancommerce):
-                    Booking.objects.create(appointment_id=rec.id)
-                if rec.planbudget > 0:
-                    gen = self.time_slots(rec.dapp, rec.appbegin, rec.append, rec.planbudget)
-                    for _ in range(rec.planbudget):
-                        Booking.objects.create(appointment_id=rec.id, slot=next(gen))
-                    gen.close()
-                    del gen
-                Appointment.objects.filter(pk=rec.id).update(is_slots=True)
+        created = slots.create_slots(queryset)
+        self.message_user(request, f'Созданы талоны для строк расписания: {len(created)}', messages.INFO)
 
     def delete_slots(self, request, queryset):
-        self.message_user(request, "Внимание! Удаление возможно, если все талоны строки расписания свободны!", messages.INFO)
-        for rec in queryset:
-            if rec.is_slots:
-                bt = Booking.objects.filter(appointment=rec.id).exclude(person=None).count()
-                if bt == 0:
-                    Booking.objects.filter(appointment=rec.id).delete()
-                    Appointment.objects.filter(pk=rec.id).update(is_slots=False)
+        deleted, skipped = slots.delete_slots(queryset)
+        self.message_user(request, f'Удалены талоны для строк расписания: {deleted}', messages.INFO)
+        if skipped:
+            msg = 'Талоны не удалены, т.к. есть забронированные: ' + '; '.join(str(rec) for rec in skipped)
+            self.message_user(request, msg, messages.WARNING)
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        dates = [form.initial['dapp']] if change and 'dapp' in form.changed_data else []
+        notify_schedule_changed(Appointment, {obj.pk: obj.dapp}, dates)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        notify_schedule_changed(Appointment, {obj.pk: obj.dapp})
+
+    def delete_queryset(self, request, queryset):
+        changed = dict(queryset.values_list('pk', 'dapp'))
+        super().delete_queryset(request, queryset)
+        notify_schedule_changed(Appointment, changed)
 
     def get_readonly_fields(self, request, obj=None):
         readonly_fields = super().get_readonly_fields(request, obj)
@@ -133,6 +137,40 @@ class AppointmentAdmin(admin.ModelAdmin):
     delete_slots.short_description = 'Удаление талонов для бронирования'
 
 
+class TimetableAdmin(admin.ModelAdmin):
+    list_display = ('doctor_fio', 'specname', 'weekday', 'room', 'appbegin', 'append', 'planbudget', 'plancommerce',
+                    'is_active')
+    list_filter = ('specname', 'weekday', 'is_active')
+    search_fields = ['doctor__last_name']
+    fieldsets = [
+        (None, {'fields': ['doctor', 'specname', 'weekday', 'room', 'is_active']}),
+        ('Часы приема', {'fields': ['appbegin', 'append']}),
+        ('План приема', {'fields': ['planbudget', 'plancommerce']})
+    ]
+    actions = ['materialize']
+    change_form_template = "registry_changeform.html"
+    form = TimetableForm
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('specname')
+
+    def get_changeform_initial_data(self, request):
+        return {'planbudget': 1, 'plancommerce': 0, 'is_active': True}
+
+    def materialize(self, request, queryset):
+        date_from = datetime.date.today() + datetime.timedelta(days=1)
+        date_to = date_from + datetime.timedelta(days=getattr(settings, 'REGISTRY_TIMETABLE_HORIZON', 28) - 1)
+        count, _ = timetable.materialize(date_from, date_to, queryset)
+        self.message_user(request, f'Создано строк расписания с {date_from:%d.%m.%Y} по {date_to:%d.%m.%Y}: {count}',
+                          messages.INFO)
+
+    def doctor_fio(self, obj):
+        return obj.doctor_fio()
+
+    doctor_fio.short_description = 'Врач'
+    materialize.short_description = 'Формирование расписания приема по шаблонам'
+
+
 class BookingAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'slot', 'person', 'person_family', 'person_name', 'person_patronymic', 'person_birth_date')
     readonly_fields = ['slot']
@@ -140,13 +178,22 @@ class BookingAdmin(admin.ModelAdmin):
     date_hierarchy = 'appointment__dapp'
     list_filter = ['appointment__specname']
     search_fields = ['person__last_name']
-    actions = ['cancel_booking']
+    actions = ['cancel_booking', 'export_csv', 'export_xlsx']
     change_form_template = "registry_changeform.html"
     form = BookingForm
+    keyset = ('-appointment__dapp', '-appointment__specname_id', '-appointment__doctor_id', 'id')
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
 
     def has_add_permission(self, request):
         return False
 
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.select_related('appointment__specname', 'person__profile')
+
     def change_view(self, request, object_id, form_url='', extra_context=None):
         extra_context = extra_context or {}
         extra_context['show_save_and_continue'] = False
@@ -156,7 +203,7 @@ class BookingAdmin(admin.ModelAdmin):
         try:
             return super().change_view(request, object_id, form_url, extra_context=extra_context)
         except IntegrityError:
-            msg = "Невозможно провести бронирование! Возможно, что такой талон уже есть."
+            msg = "Невозможно провести бронирование! Талон уже занят, или такой талон у посетителя уже есть."
             self.message_user(request, msg, messages.ERROR)
             opts = self.model._meta
             return_url = reverse('admin:%s_%s_change' % (opts.app_label, opts.model_name), args=(object_id,),
@@ -174,11 +221,26 @@ class BookingAdmin(admin.ModelAdmin):
         actions = super().get_actions(request)
         if 'delete_selected' in actions:
             del actions['delete_selected']
+        if 'xlsx' not in export.FORMATS:
+            actions.pop('export_xlsx', None)
         return actions
 
+    def save_model(self, request, obj, form, change):
+        if 'person' not in form.changed_data or obj.person is None:
+            return super().save_model(request, obj, form, change)
+        # Условный UPDATE талона: при параллельном сохранении того же талона счетчики уменьшаются один раз
+        if slots.claim_ticket(obj.pk, obj.person) != slots.CLAIMED:
+            raise IntegrityError('Талон уже забронирован')
+
     def cancel_booking(self, request, queryset):
-        for rec in queryset:
-            Booking.objects.filter(pk=rec.id).update(person=None)
+        cancelled = slots.cancel_bookings(queryset)
+        self.message_user(request, f'Отменено бронирований: {cancelled}', messages.INFO)
+
+    def export_csv(self, request, queryset):
+        return export.csv_response(queryset, f'booking_{datetime.date.today():%Y%m%d}', request)
+
+    def export_xlsx(self, request, queryset):
+        return export.xlsx_response(queryset, f'booking_{datetime.date.today():%Y%m%d}')
 
     def person_family(self, obj):
         res = None
@@ -209,6 +271,53 @@ class BookingAdmin(admin.ModelAdmin):
     person_patronymic.short_description = 'Отчество'
     person_birth_date.short_description = 'Д.Р.'
     cancel_booking.short_description = 'Отмена бронирования'
+    export_csv.short_description = 'Выгрузка в CSV'
+    export_xlsx.short_description = 'Выгрузка в XLSX'
+
+
+class ArchiveAdmin(admin.ModelAdmin):
+    """Архив только для просмотра."""
+    show_full_result_count = False
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+class ArchivedAppointmentAdmin(ArchiveAdmin):
+    list_display = ('dapp', 'specname', 'doctor_fio', 'room', 'appbegin', 'append', 'planbudget', 'plancommerce',
+                    'tickets')
+    list_filter = ('specname',)
+    search_fields = ['doctor__last_name']
+    date_hierarchy = 'dapp'
+    keyset = ('-dapp', '-specname_id', '-doctor_id')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('specname')
+
+    def doctor_fio(self, obj):
+        return obj.doctor_fio()
+
+    doctor_fio.short_description = 'Врач'
+
+
+class ArchivedBookingAdmin(ArchiveAdmin):
+    list_display = ('__str__', 'slot', 'person')
+    list_filter = ['appointment__specname']
+    search_fields = ['person__last_name']
+    date_hierarchy = 'appointment__dapp'
+    keyset = ('-appointment__dapp', '-appointment__specname_id', '-appointment__doctor_id', 'id')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('appointment__specname', 'person')
 
 
 class ProfileAdmin(admin.ModelAdmin):
@@ -263,7 +372,7 @@ class ProfileAdmin(admin.ModelAdmin):
 class CustomUserAdmin(UserAdmin):
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).prefetch_related('groups')
         if not request.user.is_superuser:
             qs = qs.filter(is_staff=False)
         return qs
@@ -290,7 +399,7 @@ class CustomUserAdmin(UserAdmin):
     @staticmethod
     @admin.display(description='Группа')
     def get_groups(obj):
-        return ','.join([str(grpname) for grpname in obj.groups.values_list('name', flat=True)])
+        return ','.join([group.name for group in obj.groups.all()])
 
     def delete_view(self, request, object_id, extra_context=None):
         try:
@@ -321,8 +430,11 @@ admin.site.index_title = 'Административный раздел'
 
 admin.site.register(Specialization, SpecializationAdmin)
 admin.site.register(Appointment, AppointmentAdmin)
+admin.site.register(Timetable, TimetableAdmin)
 admin.site.register(Profile, ProfileAdmin)
 admin.site.register(Booking, BookingAdmin)
+admin.site.register(ArchivedAppointment, ArchivedAppointmentAdmin)
+admin.site.register(ArchivedBooking, ArchivedBookingAdmin)
 
 admin.site.unregister(User)
 admin.site.register(User, CustomUserAdmin)
@@ -1,7 +1,18 @@
 from django.apps import AppConfig
+from django.core.management import call_command
+from django.db.models.signals import post_migrate
+
+
+def create_cache_tables(using='default', verbosity=1, **kwargs):
+    # Таблицы DatabaseCache (общий кэш из CACHES) создаются вместе с таблицами приложения
+    call_command('createcachetable', database=using, verbosity=verbosity)
 
 
 class RegistryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'registry'
     verbose_name = 'Регистратура'
+
+    def ready(self):
+        from . import backends, checks, live, schedule  # noqa: F401
+        post_migrate.connect(create_cache_tables, sender=self)
@@ -0,0 +1,51 @@
+import datetime
+from django.conf import settings
+from django.db import connection, transaction
+from .models import Appointment, ArchivedAppointment, ArchivedBooking, Booking, DaySummary
+
+BATCH_SIZE = 200
+APPOINTMENT_FIELDS = ('id', 'dapp', 'specname_id', 'doctor_id', 'room', 'appbegin', 'append', 'planbudget',
+                      'plancommerce', 'tickets')
+BOOKING_FIELDS = ('id', 'appointment_id', 'slot', 'person_id')
+
+
+def horizon():
+    return datetime.date.today() - datetime.timedelta(days=max(getattr(settings, 'REGISTRY_ARCHIVE_DAYS', 90), 1))
+
+
+def archive_batch(before, batch_size=BATCH_SIZE):
+    with transaction.atomic():
+        pks = list(Appointment.objects.filter(dapp__lt=before).order_by('dapp', 'pk').
+                   values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return 0, 0
+        ArchivedAppointment.objects.bulk_create(
+            [ArchivedAppointment(**values) for values in
+             Appointment.objects.filter(pk__in=pks).order_by().values(*APPOINTMENT_FIELDS)])
+        bookings = Booking.objects.filter(appointment__in=pks).order_by()
+        ArchivedBooking.objects.bulk_create(
+            [ArchivedBooking(**values) for values in bookings.values(*BOOKING_FIELDS).iterator()], batch_size=1000)
+        moved, _ = bookings.delete()
+        Appointment.objects.filter(pk__in=pks).delete()
+    return len(pks), moved
+
+
+def archive(before=None, batch_size=BATCH_SIZE):
+    """
+    Перенос строк расписания с днем приема раньше before (по умолчанию - REGISTRY_ARCHIVE_DAYS дней назад)
+    и их талонов в архивные таблицы. Каждая пачка из batch_size строк переносится в отдельной транзакции.
+    """
+    before = before or horizon()
+    appointments = bookings = 0
+    while True:
+        moved_appointments, moved_bookings = archive_batch(before, batch_size)
+        if not moved_appointments:
+            break
+        appointments += moved_appointments
+        bookings += moved_bookings
+    DaySummary.objects.filter(dapp__lt=before).delete()
+    if appointments and connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {Appointment._meta.db_table}')
+            cursor.execute(f'ANALYZE {Booking._meta.db_table}')
+    return appointments, bookings
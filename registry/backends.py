@@ -0,0 +1,98 @@
+import uuid
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+VERSION_KEY = 'registry:perms:version:{}'
+PERMS_KEY = 'registry:perms:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'REGISTRY_PERMISSION_CACHE', 'default')]
+
+
+def get_timeout():
+    return getattr(settings, 'REGISTRY_PERMISSION_TIMEOUT', 3600)
+
+
+def perms_keys(user_id):
+    return VERSION_KEY.format('all'), VERSION_KEY.format(user_id), PERMS_KEY.format(user_id)
+
+
+def touch(user_ids=None):
+    """
+    Новая версия прав пользователей user_ids (None - всех пользователей) после фиксации транзакции: права,
+    прочитанные другим процессом до фиксации, сохранены с прежней версией и больше не используются.
+    Версия живет дольше сохраненных прав, чтобы после ее истечения не ожидали устаревшие права.
+    """
+    keys = [VERSION_KEY.format(user_id) for user_id in user_ids] if user_ids is not None \
+        else [VERSION_KEY.format('all')]
+
+    def bump():
+        version = uuid.uuid4().hex
+        get_cache().set_many({key: version for key in keys}, 2 * get_timeout())
+
+    transaction.on_commit(bump)
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend с кэшем прав пользователя (включая права его групп) в кэше REGISTRY_PERMISSION_CACHE, общем
+    для процессов. Права хранятся вместе с версиями прав пользователя и всех пользователей, которые меняются
+    при изменении состава групп, прав пользователя, прав групп и самих групп и прав. Проверка - одно чтение
+    кэша, запись - только при отсутствии прав в кэше или смене версии.
+    """
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return super().get_all_permissions(user_obj, obj)
+        if not hasattr(user_obj, '_perm_cache'):
+            cache = get_cache()
+            *keys, key = perms_keys(user_obj.pk)
+            values = cache.get_many([*keys, key])
+            versions = tuple(values.get(name) for name in keys)
+            cached = values.get(key)
+            if cached is not None and cached[0] == versions:
+                perms = cached[1]
+            else:
+                perms = super().get_all_permissions(user_obj)
+                cache.set(key, (versions, perms), get_timeout())
+            user_obj._perm_cache = perms
+        return user_obj._perm_cache
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        touch([instance.pk])
+    elif pk_set:
+        touch(pk_set)
+    else:
+        touch()
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action.startswith('post_'):
+        touch()
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Permission)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    touch()
+
+
+@receiver(post_save, sender=User)
+def invalidate_saved_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not set(update_fields) <= {'last_login', 'password'}:
+        touch([instance.pk])
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, register
+
+# Настройки с алиасами кэшей, которые должны быть общими для всех процессов, и алиас по умолчанию
+SHARED_CACHES = {'REGISTRY_SCHEDULE_CACHE': 'default', 'REGISTRY_DIRECTORY_CACHE': None,
+                 'REGISTRY_PERMISSION_CACHE': 'default'}
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    errors = []
+    for name, default in SHARED_CACHES.items():
+        alias = getattr(settings, name, default)
+        if alias is None:
+            continue
+        if alias not in settings.CACHES:
+            errors.append(Error(f'{name}: кэш {alias!r} не описан в CACHES', id='registry.E001'))
+        elif isinstance(caches[alias], (LocMemCache, DummyCache)):
+            errors.append(Error(
+                f'{name}: кэш {alias!r} не является общим для процессов', id='registry.E002',
+                hint='Укажите DatabaseCache, Redis или Memcached, иначе другие процессы не увидят сброс кэша.'))
+    return errors
@@ -0,0 +1,77 @@
+import time
+import uuid
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db.models import Q
+
+VERSION_KEY = 'registry:doctor-directory:version'
+
+
+def short_name(last_name, first_name, patronymic):
+    fio = f'{last_name} {first_name[0]}.'
+    if patronymic != '-':
+        fio += f'{patronymic[0]}.'
+    return fio
+
+
+class DoctorDirectory:
+    """Краткие ФИО врачей по коду пользователя.
+
+    Справочник хранится в памяти процесса. Если задан REGISTRY_DIRECTORY_CACHE (алиас кэша Django),
+    версия справочника согласуется между процессами не реже, чем раз в REGISTRY_DIRECTORY_TIMEOUT секунд.
+    """
+
+    def __init__(self):
+        self.names = {}
+        self.loaded = False
+        self.version = None
+        self.checked = 0.0
+
+    @staticmethod
+    def shared_cache():
+        alias = getattr(settings, 'REGISTRY_DIRECTORY_CACHE', None)
+        return caches[alias] if alias else None
+
+    def clear(self):
+        self.names = {}
+        self.loaded = False
+
+    def sync(self):
+        cache = self.shared_cache()
+        if cache is None or time.monotonic() - self.checked < getattr(settings, 'REGISTRY_DIRECTORY_TIMEOUT', 5):
+            return
+        # Только чтение: версия записывается при изменении справочника (invalidate)
+        version = cache.get(VERSION_KEY)
+        if version != self.version:
+            self.clear()
+            self.version = version
+        self.checked = time.monotonic()
+
+    def load(self, *user_ids):
+        users = User.objects.filter(pk__in=user_ids)
+        if not self.loaded:
+            users = User.objects.filter(Q(groups__name='Врачи') | Q(pk__in=user_ids)).distinct()
+            self.loaded = True
+        names = {user_id: short_name(last_name, first_name, patronymic) for user_id, last_name, first_name, patronymic
+                 in users.values_list('pk', 'last_name', 'first_name', 'profile__patronymic')}
+        self.names.update(names)
+        return names
+
+    def get(self, user_id):
+        self.sync()
+        name = self.names.get(user_id)
+        if name is None:
+            name = self.load(user_id)[user_id]
+        return name
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.names.pop(user_id, None)
+        self.loaded = False
+        cache = self.shared_cache()
+        if cache is not None:
+            cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+doctor_directory = DoctorDirectory()
@@ -0,0 +1,110 @@
+import csv
+import tempfile
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, StreamingHttpResponse
+from .directory import doctor_directory
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+CHUNK_SIZE = 2000
+HEADER = ('Дата', 'Специализация', 'Врач', 'Кабинет', 'Прием', 'Время', 'Фамилия', 'Имя', 'Отчество',
+          'Дата рождения', 'Номер документа')
+ORDERING = ('appointment__dapp', 'appointment__specname__specname', 'appointment__doctor_id', 'slot', 'id')
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def rows(queryset, chunk_size=CHUNK_SIZE):
+    queryset = queryset.select_related('appointment__specname', 'person__profile').order_by(*ORDERING)
+    for rec in queryset.iterator(chunk_size=chunk_size):
+        appointment, person = rec.appointment, rec.person
+        profile = person.profile if person else None
+        yield (
+            f'{appointment.dapp:%d.%m.%Y}', appointment.specname.specname,
+            doctor_directory.get(appointment.doctor_id), appointment.room, f'{appointment.appbegin:%H:%M}-{appointment.append:%H:%M}',
+            rec.slot.strftime('%H:%M') if rec.slot else 'Без очереди',
+            person.last_name if person else '', person.first_name if person else '',
+            profile.patronymic if profile else '',
+            f'{profile.birth_date:%d.%m.%Y}' if profile and profile.birth_date else '',
+            (profile.idnumber or '') if profile else '',
+        )
+
+
+def chunks(queryset, chunk_size=CHUNK_SIZE):
+    """Текст CSV пачками по chunk_size записей."""
+    writer = csv.writer(Echo(), delimiter=';')
+    chunk = ['\ufeff' + writer.writerow(HEADER)]
+    for row in rows(queryset, chunk_size):
+        chunk.append(writer.writerow(row))
+        if len(chunk) >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+
+async def achunks(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Асинхронный вариант chunks для ASGI: каждая пачка читается и форматируется в потоке синхронного кода, чтобы
+    сервер отдавал ответ по частям, а не собирал его целиком в памяти.
+    """
+    content = chunks(queryset, chunk_size)
+    pull = sync_to_async(next)
+    try:
+        while (chunk := await pull(content, None)) is not None:
+            yield chunk
+    finally:
+        await sync_to_async(content.close)()
+
+
+def csv_response(queryset, filename, request=None):
+    content = achunks(queryset) if isinstance(request, ASGIRequest) else chunks(queryset)
+    response = StreamingHttpResponse(content, content_type='text/csv; charset=utf-8')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+    return response
+
+
+async def ablocks(output, block_size):
+    """Асинхронное чтение файла блоками для ASGI: иначе FileResponse целиком читается в память перед отправкой."""
+    read = sync_to_async(output.read)
+    while block := await read(block_size):
+        yield block
+
+
+def xlsx_response(queryset, filename, request=None):
+    """
+    XLSX - zip-архив с оглавлением в конце, поэтому книга сначала полностью записывается во временный файл
+    на диске (в памяти - только текущая пачка строк), а уже готовый файл отдается блоками. Файл удаляется
+    при закрытии ответа.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Бронирование')
+    sheet.append(HEADER)
+    for row in rows(queryset):
+        sheet.append(row)
+    output = tempfile.TemporaryFile()
+    try:
+        workbook.save(output)
+    except BaseException:
+        output.close()
+        raise
+    output.seek(0)
+    response = FileResponse(output, as_attachment=True, filename=f'{filename}.xlsx',
+                            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    if isinstance(request, ASGIRequest):
+        response.streaming_content = ablocks(output, response.block_size)
+    return response
+
+
+FORMATS = {'csv': csv_response}
+if openpyxl is not None:
+    FORMATS['xlsx'] = xlsx_response
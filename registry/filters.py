@@ -1,16 +1,22 @@
-from django_filters import FilterSet, DateFilter
-from django.forms import DateInput
+from django_filters import FilterSet, DateFilter, BooleanFilter
+from django.db.models import Q
+from django.forms import DateInput, CheckboxInput
 from .models import Appointment
 
 
 class AppointmentFilter(FilterSet):
     dapp = DateFilter(widget=DateInput(format='%Y-%m-%d',
                                        attrs={'class': 'form-control datetimepicker-input', 'type': 'date'}))
+    free = BooleanFilter(method='filter_free', label='Есть свободные талоны', widget=CheckboxInput)
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.filters['specname'].extra.update({'empty_label': 'Специализация'})
 
+    def filter_free(self, queryset, name, value):
+        if value:
+            return queryset.filter(Q(freebudget__gt=0) | Q(freecommerce__gt=0))
+        return queryset
 
     class Meta:
         model = Appointment
@@ -4,7 +4,7 @@ from django.core.exceptions import ValidationError
 from django.contrib.auth.forms import AuthenticationForm
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
-from .models import Appointment, Profile, Booking
+from .models import Appointment, DaySummary, Profile, Booking, Specialization, Timetable
 import datetime
 
 
@@ -44,6 +44,26 @@ class AppointmentForm(forms.ModelForm):
                 raise ValidationError('Время окончания приема должно быть больше времени начала!', code='invalid')
 
 
+class TimetableForm(forms.ModelForm):
+    doctor = forms.ModelChoiceField(
+        queryset=User.objects.filter(is_staff=False),
+        label='Врач',
+        widget=autocomplete.ModelSelect2(url='select2_fk_doctor')
+    )
+
+    class Meta:
+        model = Timetable
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        appbegin = cleaned_data.get('appbegin')
+        append = cleaned_data.get('append')
+        if appbegin is not None and append is not None:
+            if append <= appbegin:
+                raise ValidationError('Время окончания приема должно быть больше времени начала!', code='invalid')
+
+
 class ProfileForm(forms.ModelForm):
     family = forms.CharField(required=False, disabled=True, label='Фамилия')
     name = forms.CharField(required=False, disabled=True, label='Имя')
@@ -73,3 +93,54 @@ class BookingForm(forms.ModelForm):
         if Booking.objects.get(pk=self.instance.pk).person is not None:
             raise ValidationError('Выбранное время уже занято! Попробуйте другое.', code='invalid')
 
+
+class BookingExportForm(forms.Form):
+    date_from = forms.DateField(label='С даты')
+    date_to = forms.DateField(label='По дату')
+    specname = forms.ModelChoiceField(queryset=Specialization.objects.all(), required=False, label='Специализация')
+    doctor = forms.ModelChoiceField(queryset=User.objects.filter(groups__name='Врачи'), required=False, label='Врач')
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('xlsx', 'XLSX')], required=False, label='Формат')
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from is not None and date_to is not None and date_to < date_from:
+            raise ValidationError('Конечная дата должна быть не меньше начальной!', code='invalid')
+        return cleaned_data
+
+    def get_queryset(self):
+        queryset = Booking.objects.filter(person__isnull=False, appointment__dapp__range=(
+            self.cleaned_data['date_from'], self.cleaned_data['date_to']))
+        if self.cleaned_data['specname']:
+            queryset = queryset.filter(appointment__specname=self.cleaned_data['specname'])
+        if self.cleaned_data['doctor']:
+            queryset = queryset.filter(appointment__doctor=self.cleaned_data['doctor'])
+        return queryset
+
+
+class FirstFreeForm(forms.Form):
+    specname = forms.ModelChoiceField(queryset=Specialization.objects.all(), label='Специализация')
+    date_from = forms.DateField(required=False, label='Не раньше даты',
+                                widget=forms.DateInput(format='%Y-%m-%d', attrs={'type': 'date'}))
+    time_from = forms.TimeField(required=False, label='Не раньше времени',
+                                widget=forms.TimeInput(format='%H:%M', attrs={'type': 'time'}))
+    doctor = forms.ModelChoiceField(queryset=User.objects.filter(groups__name='Врачи'), required=False, label='Врач',
+                                    widget=autocomplete.ModelSelect2(url='select2_fk_doctor'))
+    person = forms.ModelChoiceField(queryset=User.objects.filter(is_staff=False), required=False, label='Посетитель',
+                                    widget=autocomplete.ModelSelect2(url='select2_fk_person'))
+
+    def search_params(self):
+        return {name: self.cleaned_data[name] for name in ('date_from', 'time_from', 'doctor')}
+
+
+class CalendarForm(forms.Form):
+    specname = forms.ModelChoiceField(queryset=Specialization.objects.all(), required=False, label='Специализация',
+                                      empty_label='Все специализации')
+    weeks = forms.IntegerField(min_value=1, max_value=12, required=False, label='Недель')
+
+    def get_queryset(self, date_from, date_to):
+        queryset = DaySummary.objects.filter(dapp__range=(date_from, date_to)).select_related('specname')
+        if self.cleaned_data['specname']:
+            queryset = queryset.filter(specname=self.cleaned_data['specname'])
+        return queryset.order_by('dapp', 'specname__specname')
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import threading
+from django.dispatch import receiver
+from .models import Booking
+from .signals import schedule_changed
+
+QUEUE_SIZE = 16
+KEEPALIVE = 20
+
+
+def free_slots_query(appointment_ids):
+    return Booking.objects.filter(appointment__in=appointment_ids, slot__isnull=False, person__isnull=True).\
+        order_by().values_list('appointment', 'pk')
+
+
+class SlotBroker:
+    """
+    Рассылка изменений свободных талонов подписчикам страниц бронирования (в пределах процесса).
+
+    На одно изменение расписания выполняется один запрос по всем строкам, на которые есть подписчики,
+    новое множество свободных талонов сравнивается с предыдущим, и одно событие раздается всем подписчикам
+    строки. Каждое событие содержит полный список свободных талонов, поэтому пропуск событий
+    переполненной очередью медленного клиента безопасен.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.watchers = {}
+        self.free = {}
+
+    async def subscribe(self, appointment_id):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(QUEUE_SIZE)
+        free = {pk async for _, pk in free_slots_query([appointment_id])}
+        with self.lock:
+            self.watchers.setdefault(appointment_id, set()).add((loop, queue))
+            free = self.free.setdefault(appointment_id, free)
+        return queue, self.event(free)
+
+    def unsubscribe(self, appointment_id, queue):
+        with self.lock:
+            watchers = self.watchers.get(appointment_id, set())
+            watchers.difference_update({watcher for watcher in watchers if watcher[1] is queue})
+            if not watchers:
+                self.watchers.pop(appointment_id, None)
+                self.free.pop(appointment_id, None)
+
+    @staticmethod
+    def event(free, taken=(), freed=()):
+        return {'free': sorted(free), 'taken': sorted(taken), 'freed': sorted(freed)}
+
+    @staticmethod
+    def deliver(queue, event):
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(event)
+
+    def publish(self, appointment_ids):
+        with self.lock:
+            watched = [pk for pk in appointment_ids if pk in self.watchers]
+        if not watched:
+            return
+        current = {pk: set() for pk in watched}
+        for appointment_id, pk in free_slots_query(watched):
+            current[appointment_id].add(pk)
+        with self.lock:
+            for appointment_id, free in current.items():
+                if appointment_id not in self.watchers:
+                    continue
+                previous = self.free.get(appointment_id, set())
+                if free == previous:
+                    continue
+                self.free[appointment_id] = free
+                event = self.event(free, previous - free, free - previous)
+                for loop, queue in self.watchers[appointment_id]:
+                    loop.call_soon_threadsafe(self.deliver, queue, event)
+
+    async def stream(self, appointment_id):
+        queue, event = await self.subscribe(appointment_id)
+        try:
+            yield self.format(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                yield self.format(event)
+        finally:
+            self.unsubscribe(appointment_id, queue)
+
+    @staticmethod
+    def format(event):
+        return f'event: slots\ndata: {json.dumps(event)}\n\n'
+
+
+slot_broker = SlotBroker()
+
+
+@receiver(schedule_changed)
+def publish_free_slots(sender, appointments, **kwargs):
+    slot_broker.publish(list(appointments))
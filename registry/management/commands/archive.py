@@ -0,0 +1,20 @@
+import datetime
+from django.core.management.base import BaseCommand
+from registry import archive
+
+
+class Command(BaseCommand):
+    help = 'Перенос прошедших строк расписания приема и их талонов в архив'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=datetime.date.fromisoformat,
+                            help='Архивировать дни приема раньше этой даты (ГГГГ-ММ-ДД); '
+                                 'по умолчанию - REGISTRY_ARCHIVE_DAYS дней назад')
+        parser.add_argument('--batch-size', type=int, default=archive.BATCH_SIZE,
+                            help='Строк расписания в одной транзакции')
+
+    def handle(self, *args, **options):
+        before = min(options['before'] or archive.horizon(), datetime.date.today())
+        appointments, bookings = archive.archive(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено в архив до {before:%d.%m.%Y}: строк расписания {appointments}, талонов {bookings}'))
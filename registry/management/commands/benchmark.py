@@ -0,0 +1,167 @@
+import datetime
+import json
+import math
+import random
+import time
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_databases, setup_test_environment, \
+    teardown_databases, teardown_test_environment
+from django.urls import reverse
+from registry.models import Appointment, Booking, Profile, SearchKey, Specialization
+from registry import schedule, slots
+
+SURNAMES = ['Иванов', 'Петров', 'Сидоров', 'Смирнов', 'Кузнецов', 'Попов', 'Васильев', 'Соколов', 'Михайлов',
+            'Новиков', 'Фёдоров', 'Морозов', 'Волков', 'Алексеев', 'Лебедев', 'Семёнов', 'Егоров', 'Павлов']
+NAMES = ['Иван', 'Пётр', 'Сергей', 'Анна', 'Мария', 'Елена', 'Ольга', 'Андрей', 'Дмитрий', 'Наталья']
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = ('Синтетическая поликлиника во временной базе данных: замер времени и количества SQL-запросов '
+            'основных страниц и действий. Результат - JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--specs', type=int, default=10, help='Количество специализаций')
+        parser.add_argument('--doctors', type=int, default=50, help='Количество врачей')
+        parser.add_argument('--patients', type=int, default=5000, help='Количество посетителей')
+        parser.add_argument('--days', type=int, default=30, help='Количество дней расписания')
+        parser.add_argument('--planbudget', type=int, default=16, help='Талонов (бюджет) на строку расписания')
+        parser.add_argument('--plancommerce', type=int, default=4, help='Талонов (внебюджет) на строку расписания')
+        parser.add_argument('--fill', type=float, default=0.5, help='Доля забронированных талонов')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторений каждого замера')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--output', help='Файл для результата (по умолчанию - стандартный вывод)')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            started = time.perf_counter()
+            self.seed(options)
+            seeded = time.perf_counter() - started
+            results = self.run(options)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+        report = {
+            'options': {name: options[name] for name in ('specs', 'doctors', 'patients', 'days', 'planbudget',
+                                                         'plancommerce', 'fill', 'repeat', 'seed')},
+            'seed_seconds': round(seeded, 3),
+            'results': results,
+        }
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
+
+    def create_users(self, prefix, n, group):
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}{i}', last_name=self.random.choice(SURNAMES), first_name=self.random.choice(NAMES))
+             for i in range(n)], batch_size=1000)
+        users = list(User.objects.filter(username__startswith=prefix).order_by('pk'))
+        Profile.objects.bulk_create(
+            [Profile(user=user, patronymic='Иванович', birth_date=datetime.date(1980, 1, 1) +
+                     datetime.timedelta(days=self.random.randrange(10000)), idnumber=f'{prefix[0]}{user.pk}')
+             for user in users], batch_size=1000)
+        SearchKey.objects.bulk_create([SearchKey(user=user, key=SearchKey.for_user(user)) for user in users],
+                                      batch_size=1000)
+        group.user_set.add(*users)
+        return users
+
+    def seed(self, options):
+        doctors_group = Group.objects.create(name='Врачи')
+        patients_group = Group.objects.create(name='Посетители')
+        patients_group.permissions.add(*Permission.objects.filter(codename__in=['view_booking', 'change_booking']))
+        specs = Specialization.objects.bulk_create(
+            [Specialization(specname=f'Специализация {i}') for i in range(options['specs'])])
+        self.doctors = self.create_users('doctor', options['doctors'], doctors_group)
+        self.patients = self.create_users('patient', options['patients'], patients_group)
+        today = datetime.date.today()
+        Appointment.objects.bulk_create(
+            [Appointment(dapp=today + datetime.timedelta(days=day), specname=specs[i % len(specs)], doctor=doctor,
+                         room=i + 1, appbegin=datetime.time(8), append=datetime.time(14),
+                         planbudget=options['planbudget'], plancommerce=options['plancommerce'])
+             for day in range(options['days']) for i, doctor in enumerate(self.doctors)], batch_size=1000)
+        slots.create_slots(Appointment.objects.exclude(dapp=today + datetime.timedelta(days=options['days'] - 1)))
+        # Бронирование: каждый посетитель не более одного талона на строку расписания.
+        tickets = {}
+        for pk, appointment_id in Booking.objects.values_list('pk', 'appointment'):
+            tickets.setdefault(appointment_id, []).append(pk)
+        booked, offset = [], 0
+        for pks in tickets.values():
+            for n, pk in enumerate(self.random.sample(pks, round(len(pks) * options['fill']))):
+                booked.append(Booking(pk=pk, person=self.patients[(offset + n) % len(self.patients)]))
+            offset += len(pks)
+        Booking.objects.bulk_update(booked, ['person'], batch_size=500)
+        Appointment.objects.recount_tickets()
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def measure(self, name, repeat, action, prepare=None):
+        timings, queries = [], []
+        for i in range(repeat):
+            if prepare is not None:
+                prepare(i)
+            with CaptureQueriesContext(connection) as ctx:
+                started = time.perf_counter()
+                response = action(i)
+                timings.append((time.perf_counter() - started) * 1000)
+            if response is not None and response.status_code >= 400:
+                raise RuntimeError(f'{name}: HTTP {response.status_code}')
+            queries.append(len(ctx.captured_queries))
+        return {
+            'name': name,
+            'repeat': repeat,
+            'ms': {'p50': round(percentile(timings, 50), 3), 'p90': round(percentile(timings, 90), 3),
+                   'p99': round(percentile(timings, 99), 3), 'max': round(max(timings), 3)},
+            'queries': {'p50': percentile(queries, 50), 'max': max(queries)},
+        }
+
+    def run(self, options):
+        repeat = options['repeat']
+        patient, admin = Client(), Client()
+        patient.force_login(self.patients[0])
+        admin.force_login(self.admin)
+        today = datetime.date.today()
+        appointment = Appointment.objects.filter(is_slots=True, freebudget__gt=0).order_by('dapp', 'pk').first()
+        free = list(Booking.objects.filter(person__isnull=True, slot__isnull=False).order_by('pk').
+                    values_list('pk', flat=True)[:repeat])
+        claimers = [Client() for _ in range(repeat)]
+        for i, client in enumerate(claimers):
+            client.force_login(self.patients[-1 - i])
+        changelist = reverse('admin:registry_appointment_changelist')
+        unslotted = list(Appointment.objects.filter(is_slots=False).values_list('pk', flat=True))
+        q = SURNAMES[0][:2]
+        results = [
+            self.measure('appointment', repeat, lambda i: patient.get(reverse('appointment')),
+                         prepare=lambda i: schedule.clear()),
+            self.measure('appointment_cached', repeat, lambda i: patient.get(reverse('appointment'))),
+            self.measure('appointment_filtered', repeat, lambda i: patient.get(
+                reverse('appointment'), {'dapp': today + datetime.timedelta(days=1), 'specname': appointment.specname_id}),
+                prepare=lambda i: schedule.clear()),
+            self.measure('booking', repeat, lambda i: patient.get(reverse('booking', args=[appointment.pk]))),
+            self.measure('booking_claim', len(free), lambda i: claimers[i].post(
+                reverse('booking_user'), {'action': 'done', 'reserve': free[i]})),
+            self.measure('mybooking', repeat, lambda i: patient.get(reverse('mybooking'))),
+            self.measure('person_autocomplete', repeat, lambda i: admin.get(reverse('select2_fk_person'), {'q': q})),
+            self.measure('doctor_autocomplete', repeat, lambda i: admin.get(reverse('select2_fk_doctor'), {'q': q})),
+        ]
+        selected = Appointment.objects.filter(pk__in=unslotted)
+        results += [
+            self.measure('admin_create_slots', repeat, lambda i: admin.post(
+                changelist, {'action': 'create_slots', '_selected_action': unslotted}),
+                prepare=lambda i: slots.delete_slots(selected)),
+            self.measure('admin_delete_slots', repeat, lambda i: admin.post(
+                changelist, {'action': 'delete_slots', '_selected_action': unslotted}),
+                prepare=lambda i: slots.create_slots(selected)),
+        ]
+        return results
@@ -0,0 +1,191 @@
+import copy
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count, F
+from django.test import Client
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases, \
+    teardown_test_environment
+from django.urls import reverse
+from registry.models import Appointment, Booking, Specialization
+from registry import slots
+
+CLAIMED, TAKEN, DUPLICATE, LOCKED, ERROR = 'claimed', 'taken', 'duplicate', 'locked', 'error'
+
+
+def claim(client, pk):
+    try:
+        response = client.post(reverse('booking_user'), {'action': 'done', 'reserve': pk})
+    except OperationalError as e:
+        return LOCKED if 'locked' in str(e) else ERROR
+    content = response.content.decode()
+    if 'забронирован для посещения' in content:
+        return CLAIMED
+    if 'уже занято' in content:
+        return TAKEN
+    if 'Невозможно провести бронирование' in content:
+        return DUPLICATE
+    return ERROR
+
+
+def worker(number, clients, tickets, attempts, seed, barrier, results):
+    connections.close_all()
+    rnd = random.Random(seed + number)
+    outcomes, claimed, timings = {}, [], []
+    try:
+        barrier.wait()
+        for i in range(attempts):
+            person, client = clients[i % len(clients)]
+            pk = rnd.choice(tickets)
+            started = time.perf_counter()
+            outcome = claim(client, pk)
+            timings.append(time.perf_counter() - started)
+            outcomes[outcome] = outcomes.get(outcome, 0) + 1
+            if outcome == CLAIMED:
+                claimed.append((pk, person))
+    finally:
+        connections.close_all()
+        results.put({'outcomes': outcomes, 'claimed': claimed, 'timings': timings})
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочная проверка одновременного бронирования: процессы-посетители соревнуются за небольшое '
+            'число свободных талонов через BookingUserUpdate во временной базе SQLite. Результат - JSON.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16, help='Количество процессов')
+        parser.add_argument('--patients', type=int, default=4, help='Посетителей на процесс')
+        parser.add_argument('--appointments', type=int, default=2, help='Строк расписания')
+        parser.add_argument('--tickets', type=int, default=20, help='Талонов (бюджет) на строку расписания')
+        parser.add_argument('--attempts', type=int, default=50, help='Попыток бронирования на процесс')
+        parser.add_argument('--seed', type=int, default=1, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--profile', action='append', choices=list(getattr(settings, 'DATABASE_PROFILES', {})),
+                            help='Профиль из settings.DATABASE_PROFILES; можно указать несколько для сравнения')
+        parser.add_argument('--output', help='Файл для результата (по умолчанию - стандартный вывод)')
+
+    def handle(self, *args, **options):
+        profiles = options['profile'] or [None]
+        setup_test_environment()
+        try:
+            reports = {profile or 'settings': self.measure(profile, options) for profile in profiles}
+        finally:
+            teardown_test_environment()
+        report = reports.popitem()[1] if len(reports) == 1 else reports
+        data = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            self.stdout.write(data)
+
+    def measure(self, profile, options):
+        db = settings.DATABASES['default']
+        if profile:
+            if profile not in getattr(settings, 'DATABASE_PROFILES', {}):
+                raise CommandError(f'Неизвестный профиль базы данных: {profile}')
+            connections['default'].close()
+            del connections['default']
+            name = db['NAME']
+            db.clear()
+            db.update(copy.deepcopy(settings.DATABASE_PROFILES[profile]), NAME=name)
+            connections.configure_settings(connections.settings)
+        if not db['ENGINE'].endswith('sqlite3'):
+            self.stderr.write('Проверка рассчитана на SQLite')
+        fd, name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(fd)
+        db.setdefault('TEST', {})['NAME'] = name
+        old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+        try:
+            return self.run(options)
+        finally:
+            connections.close_all()
+            teardown_databases(old_config, verbosity=0)
+            for path in (name, name + '-wal', name + '-shm'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def seed(self, options):
+        group = Group.objects.create(name='Посетители')
+        group.permissions.add(*Permission.objects.filter(codename__in=['view_booking', 'change_booking']))
+        specname = Specialization.objects.create(specname='Терапевт')
+        dapp = datetime.date.today() + datetime.timedelta(days=1)
+        for i in range(options['appointments']):
+            doctor = User.objects.create(username=f'doctor{i}', last_name='Иванов', first_name='Иван')
+            Appointment.objects.create(dapp=dapp, specname=specname, doctor=doctor, room=i + 1,
+                                       appbegin=datetime.time(8), append=datetime.time(16),
+                                       planbudget=options['tickets'], plancommerce=0)
+        slots.create_slots(Appointment.objects.all())
+        clients = []
+        for i in range(options['workers'] * options['patients']):
+            user = User.objects.create(username=f'patient{i}', last_name='Петров', first_name='Пётр')
+            user.groups.add(group)
+            client = Client()
+            client.force_login(user)
+            clients.append((user.pk, client))
+        return clients, list(Booking.objects.values_list('pk', flat=True))
+
+    def run(self, options):
+        clients, tickets = self.seed(options)
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        barrier = context.Barrier(options['workers'] + 1, timeout=60)
+        results = context.Queue()
+        n = options['patients']
+        processes = [
+            context.Process(target=worker, args=(i, clients[i * n:(i + 1) * n], tickets, options['attempts'],
+                                                 options['seed'], barrier, results))
+            for i in range(options['workers'])
+        ]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        started = time.perf_counter()
+        collected = [results.get() for _ in processes]
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+
+        outcomes, claimed, timings = {}, [], []
+        for result in collected:
+            for outcome, count in result['outcomes'].items():
+                outcomes[outcome] = outcomes.get(outcome, 0) + count
+            claimed += result['claimed']
+            timings += result['timings']
+        owners = dict(Booking.objects.filter(person__isnull=False).values_list('pk', 'person'))
+        double_claims = len(claimed) - len({pk for pk, person in claimed})
+        lost_claims = sum(1 for pk, person in claimed if owners.get(pk) != person)
+        constraint_violations = Booking.objects.filter(person__isnull=False).values('appointment', 'person').\
+            annotate(n=Count('pk')).filter(n__gt=1).count()
+        counters_mismatch = Appointment.objects.with_free_tickets().exclude(freebudget=F('btckt_free')).count()
+        attempts = sum(outcomes.values())
+        timings.sort()
+        return {
+            'options': {name: options[name] for name in ('workers', 'patients', 'appointments', 'tickets',
+                                                         'attempts', 'seed')},
+            'database': {'engine': connection.settings_dict['ENGINE'],
+                         'options': {k: str(v) for k, v in connection.settings_dict.get('OPTIONS', {}).items()}},
+            'seconds': round(elapsed, 3),
+            'attempts': attempts,
+            'outcomes': outcomes,
+            'claims_per_second': round(outcomes.get(CLAIMED, 0) / elapsed, 2) if elapsed else None,
+            'conflict_rate': round((outcomes.get(TAKEN, 0) + outcomes.get(DUPLICATE, 0)) / attempts, 4)
+            if attempts else None,
+            'locked_errors': outcomes.get(LOCKED, 0),
+            'latency_ms': {'p50': round(timings[len(timings) // 2] * 1000, 3) if timings else None,
+                           'max': round(timings[-1] * 1000, 3) if timings else None},
+            'tickets': len(tickets),
+            'tickets_booked': len(owners),
+            'double_claims': double_claims,
+            'lost_claims': lost_claims,
+            'constraint_violations': constraint_violations,
+            'counters_mismatch': counters_mismatch,
+            'ok': not (double_claims or lost_claims or constraint_violations or counters_mismatch),
+        }
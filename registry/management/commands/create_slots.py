@@ -0,0 +1,22 @@
+import datetime
+from django.core.management.base import BaseCommand
+from registry.models import Appointment
+from registry import slots
+
+
+class Command(BaseCommand):
+    help = 'Создание талонов для бронирования по строкам расписания за период'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date_from', type=datetime.date.fromisoformat, help='Начальная дата приема (ГГГГ-ММ-ДД)')
+        parser.add_argument('date_to', type=datetime.date.fromisoformat, help='Конечная дата приема (ГГГГ-ММ-ДД)')
+        parser.add_argument('--specname', type=int, help='Код специализации')
+        parser.add_argument('--batch-size', type=int, default=slots.BATCH_SIZE, help='Размер пакета вставки талонов')
+
+    def handle(self, *args, **options):
+        queryset = Appointment.objects.filter(dapp__range=(options['date_from'], options['date_to']))
+        if options['specname']:
+            queryset = queryset.filter(specname=options['specname'])
+        created = slots.create_slots(queryset, batch_size=options['batch_size'])
+        tickets = sum(rec.planbudget + rec.plancommerce for rec in created)
+        self.stdout.write(self.style.SUCCESS(f'Созданы талоны для строк расписания: {len(created)}, талонов: {tickets}'))
@@ -0,0 +1,29 @@
+import datetime
+from django.core.management.base import BaseCommand
+from registry.models import Timetable
+from registry import slots, timetable
+
+
+class Command(BaseCommand):
+    help = 'Формирование строк расписания приема за период по шаблонам расписания врачей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('date_from', type=datetime.date.fromisoformat, help='Начальная дата приема (ГГГГ-ММ-ДД)')
+        parser.add_argument('date_to', type=datetime.date.fromisoformat, help='Конечная дата приема (ГГГГ-ММ-ДД)')
+        parser.add_argument('--specname', type=int, help='Код специализации')
+        parser.add_argument('--doctor', type=int, help='Код врача')
+        parser.add_argument('--slots', action='store_true', help='Создать талоны для новых строк расписания')
+        parser.add_argument('--batch-size', type=int, default=slots.BATCH_SIZE, help='Размер пакета вставки')
+
+    def handle(self, *args, **options):
+        queryset = Timetable.objects.all()
+        if options['specname']:
+            queryset = queryset.filter(specname=options['specname'])
+        if options['doctor']:
+            queryset = queryset.filter(doctor=options['doctor'])
+        count, created = timetable.materialize(options['date_from'], options['date_to'], queryset,
+                                               tickets=options['slots'], batch_size=options['batch_size'])
+        msg = f'Создано строк расписания: {count}'
+        if options['slots']:
+            msg += f', талонов: {sum(rec.planbudget + rec.plancommerce for rec in created)}'
+        self.stdout.write(self.style.SUCCESS(msg))
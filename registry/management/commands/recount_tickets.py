@@ -0,0 +1,38 @@
+import datetime
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from registry.models import Appointment
+from registry import summary
+
+
+class Command(BaseCommand):
+    help = 'Проверка и пересчет счетчиков свободных талонов строк расписания по таблице booking'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только проверить счетчики, не исправляя их')
+        parser.add_argument('--from', dest='date_from', type=datetime.date.fromisoformat, help='Начальная дата приема (ГГГГ-ММ-ДД)')
+
+    def handle(self, *args, **options):
+        queryset = Appointment.objects.all()
+        if options['date_from']:
+            queryset = queryset.filter(dapp__gte=options['date_from'])
+        with transaction.atomic():
+            mismatched = queryset.with_free_tickets().exclude(
+                Q(freebudget=F('btckt_free')) & Q(freecommerce=F('ctckt_free')) & Q(tickets=F('tckt_total'))
+            )
+            ids = list(mismatched.values_list('pk', flat=True))
+            for rec in mismatched.select_related('specname'):
+                self.stdout.write(
+                    f'{rec}: бюджет {rec.freebudget}/{rec.btckt_free}, внебюджет {rec.freecommerce}/{rec.ctckt_free}, '
+                    f'всего {rec.tickets}/{rec.tckt_total}'
+                )
+            if options['check']:
+                if ids:
+                    raise CommandError(f'Расхождение счетчиков талонов: {len(ids)} строк расписания')
+                self.stdout.write(self.style.SUCCESS('Счетчики талонов совпадают'))
+                return
+            Appointment.objects.filter(pk__in=ids).recount_tickets()
+            summary.rebuild(options['date_from'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано строк расписания: {len(ids)}'))
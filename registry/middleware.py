@@ -0,0 +1,106 @@
+import logging
+import time
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger('registry.queries')
+
+
+class QueryRecorder:
+    """
+    Обертка выполнения SQL (connection.execute_wrapper): количество запросов, суммарное время
+    и повторяющиеся запросы (одинаковый текст SQL с разными параметрами - типичный признак N+1).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.fingerprints = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.count += 1
+            self.fingerprints[sql] += 1
+
+    @property
+    def duplicates(self):
+        # Запросы DatabaseCache одинаковы для любых ключей и признаком N+1 не являются
+        tables = [f'"{params["LOCATION"]}"' for params in settings.CACHES.values()
+                  if params['BACKEND'].endswith('.DatabaseCache')]
+        return {sql: n for sql, n in self.fingerprints.items()
+                if n > 1 and not any(table in sql for table in tables)}
+
+
+@contextmanager
+def record_queries(using=None):
+    recorder = QueryRecorder()
+    with ExitStack() as stack:
+        for alias in [using] if using else connections:
+            stack.enter_context(connections[alias].execute_wrapper(recorder))
+        yield recorder
+
+
+def get_budget(view_name):
+    return getattr(settings, 'REGISTRY_QUERY_BUDGETS', {}).get(view_name)
+
+
+class QueryBudgetMiddleware:
+    """
+    Учет SQL-запросов представления по имени представления. Запросы сессии и пользователя не учитываются
+    только потому, что их раньше выполняет SessionSecurityMiddleware (он должен стоять в MIDDLEWARE выше);
+    сохранение сессии после ответа также выполняется вне учета. Превышение бюджета из REGISTRY_QUERY_BUDGETS пишется в журнал registry.queries
+    с уровнем WARNING, при DEBUG статистика отдается в заголовках X-Query-*.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with record_queries() as recorder:
+            response = self.get_response(request)
+        return self.process_response(request, response, recorder)
+
+    async def __acall__(self, request):
+        # Асинхронные представления выполняют запросы в потоке синхронного кода (sync_to_async),
+        # поэтому обертка подключается к соединениям этого потока
+        stack = ExitStack()
+        recorder = await sync_to_async(stack.enter_context)(record_queries())
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        return self.process_response(request, response, recorder)
+
+    def process_response(self, request, response, recorder):
+        response.query_stats = recorder
+        match = request.resolver_match
+        view_name = match.view_name if match else request.path
+        budget = get_budget(view_name)
+        exceeded = budget is not None and recorder.count > budget
+        logger.log(logging.WARNING if exceeded else logging.INFO,
+                   '%s: %d запросов (бюджет %s), %.1f мс, повторов %d', view_name, recorder.count, budget,
+                   recorder.time * 1000, len(recorder.duplicates),
+                   extra={'view_name': view_name, 'queries': recorder.count, 'budget': budget,
+                          'duplicates': recorder.duplicates})
+        if settings.DEBUG:
+            response['X-Query-Count'] = recorder.count
+            response['X-Query-Time'] = f'{recorder.time * 1000:.1f}'
+            response['X-Query-Duplicates'] = sum(n - 1 for n in recorder.duplicates.values())
+            if budget is not None:
+                response['X-Query-Budget'] = budget
+                response['X-Query-Budget-Exceeded'] = int(exceeded)
+        return response
@@ -0,0 +1,44 @@
+# Generated by Django 5.0 on 2026-10-18 01:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount_tickets(apps, schema_editor):
+    Appointment = apps.get_model('registry', 'Appointment')
+    Booking = apps.get_model('registry', 'Booking')
+
+    def tickets(**kwargs):
+        qs = Booking.objects.filter(appointment=OuterRef('pk'), **kwargs).order_by().values('appointment')
+        return Coalesce(Subquery(qs.annotate(n=Count('pk')).values('n')), 0)
+
+    Appointment.objects.update(freebudget=tickets(slot__isnull=False, person__isnull=True),
+                               freecommerce=tickets(slot__isnull=True, person__isnull=True),
+                               tickets=tickets())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0044_alter_appointment_is_slots'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='freebudget',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Свободно (бюджет)'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='freecommerce',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Свободно (внебюджет)'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='tickets',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Выдано талонов'),
+        ),
+        migrations.RunPython(recount_tickets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0 on 2026-10-18 01:21
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_search_keys(apps, schema_editor):
+    User = apps.get_model('auth', 'User')
+    SearchKey = apps.get_model('registry', 'SearchKey')
+    SearchKey.objects.bulk_create(
+        [SearchKey(user_id=pk, key=' '.join(f'{last_name} {first_name}'.split()).casefold().replace('ё', 'е'))
+         for pk, last_name, first_name in User.objects.values_list('pk', 'last_name', 'first_name').iterator()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('registry', '0045_appointment_ticket_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchKey',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+                ('key', models.CharField(max_length=301, verbose_name='Ключ поиска')),
+            ],
+            options={
+                'verbose_name': 'Ключ поиска пользователя',
+                'verbose_name_plural': 'Ключи поиска пользователей',
+                'db_table': 'search_key',
+                'managed': True,
+                'indexes': [models.Index(fields=['key'], name='search_key_key_idx')],
+            },
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 5.0 on 2026-10-18 01:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0047_timetable'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedAppointment',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('dapp', models.DateField(verbose_name='День приема')),
+                ('room', models.PositiveSmallIntegerField(verbose_name='Кабинет')),
+                ('appbegin', models.TimeField(verbose_name='Начало')),
+                ('append', models.TimeField(verbose_name='Окончание')),
+                ('planbudget', models.PositiveSmallIntegerField(verbose_name='Бюджет')),
+                ('plancommerce', models.PositiveSmallIntegerField(verbose_name='Внебюджет')),
+                ('tickets', models.PositiveSmallIntegerField(default=0, verbose_name='Выдано талонов')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Врач')),
+                ('specname', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='registry.specialization', verbose_name='Специализация')),
+            ],
+            options={
+                'verbose_name': 'Строка архива расписания',
+                'verbose_name_plural': 'Архив расписания приема',
+                'db_table': 'appointment_archive',
+                'ordering': ('-dapp', 'specname', 'doctor'),
+                'managed': True,
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedBooking',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('slot', models.TimeField(blank=True, null=True, verbose_name='Время')),
+                ('appointment', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='registry.archivedappointment', verbose_name='Расписание')),
+                ('person', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Посетитель')),
+            ],
+            options={
+                'verbose_name': 'Талон (архив)',
+                'verbose_name_plural': 'Архив бронирования',
+                'db_table': 'booking_archive',
+                'ordering': ('appointment', 'slot'),
+                'managed': True,
+            },
+        ),
+        migrations.AddIndex(
+            model_name='archivedappointment',
+            index=models.Index(fields=['-dapp', '-specname', '-doctor'], name='appointment_archive_key_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedbooking',
+            index=models.Index(fields=['person', 'appointment'], name='booking_archive_person_idx'),
+        ),
+    ]
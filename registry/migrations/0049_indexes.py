@@ -0,0 +1,42 @@
+# Generated by Django 5.0 on 2026-10-18 01:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0048_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RenameIndex(
+            model_name='booking',
+            new_name='booking_appointment_slot_idx',
+            old_fields=('appointment', 'slot'),
+        ),
+        migrations.AlterIndexTogether(
+            name='appointment',
+            index_together=set(),
+        ),
+        migrations.AlterField(
+            model_name='booking',
+            name='person',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, to=settings.AUTH_USER_MODEL, verbose_name='Посетитель'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('is_slots', True)), fields=['dapp'], name='appointment_slots_dapp_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('person__isnull', True)), fields=['appointment', 'slot'], name='booking_free_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='booking',
+            index=models.Index(condition=models.Q(('person__isnull', False)), fields=['person', 'appointment'], name='booking_person_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0 on 2026-10-18 01:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def fill_day_summary(apps, schema_editor):
+    Appointment = apps.get_model('registry', 'Appointment')
+    DaySummary = apps.get_model('registry', 'DaySummary')
+    totals = Appointment.objects.filter(is_slots=True).order_by().values('dapp', 'specname').\
+        annotate(doctors=Count('pk'), freebudget=Sum('freebudget'), freecommerce=Sum('freecommerce'))
+    DaySummary.objects.bulk_create(
+        (DaySummary(dapp=rec['dapp'], specname_id=rec['specname'], doctors=rec['doctors'],
+                    freebudget=rec['freebudget'], freecommerce=rec['freecommerce']) for rec in totals.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0049_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DaySummary',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('dapp', models.DateField(verbose_name='День приема')),
+                ('doctors', models.PositiveSmallIntegerField(default=0, verbose_name='Врачей')),
+                ('freebudget', models.PositiveIntegerField(default=0, verbose_name='Свободно (бюджет)')),
+                ('freecommerce', models.PositiveIntegerField(default=0, verbose_name='Свободно (внебюджет)')),
+                ('specname', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, to='registry.specialization', verbose_name='Специализация')),
+            ],
+            options={
+                'verbose_name': 'Сводка дня',
+                'verbose_name_plural': 'Сводка свободных талонов по дням',
+                'db_table': 'day_summary',
+                'ordering': ('dapp', 'specname'),
+                'managed': True,
+                'unique_together': {('dapp', 'specname')},
+            },
+        ),
+        migrations.RunPython(fill_day_summary, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-18 01:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registry', '0050_day_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('freebudget__gt', 0), ('is_slots', True)), fields=['specname', 'dapp'], name='appointment_free_budget_idx'),
+        ),
+    ]
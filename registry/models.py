@@ -1,9 +1,12 @@
 import datetime
 from django.db import models
-from django.db.models.signals import post_save
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import m2m_changed, post_init, post_save
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.dispatch import receiver
+from .directory import doctor_directory
 
 
 class Specialization(models.Model):
@@ -21,6 +24,29 @@ class Specialization(models.Model):
         return self.specname
 
 
+class AppointmentQuerySet(models.QuerySet):
+
+    def with_free_tickets(self):
+        return self.annotate(
+            btckt_free=Count('booking', filter=Q(booking__slot__isnull=False, booking__person__isnull=True)),
+            ctckt_free=Count('booking', filter=Q(booking__slot__isnull=True, booking__person__isnull=True)),
+            tckt_total=Count('booking'),
+        )
+
+    def recount_tickets(self):
+        def tickets(**kwargs):
+            qs = Booking.objects.filter(appointment=OuterRef('pk'), **kwargs).order_by().values('appointment')
+            return Coalesce(Subquery(qs.annotate(n=Count('pk')).values('n')), 0)
+
+        return self.update(freebudget=tickets(slot__isnull=False, person__isnull=True),
+                           freecommerce=tickets(slot__isnull=True, person__isnull=True),
+                           tickets=tickets())
+
+    def change_free_tickets(self, slot, delta):
+        field = 'freecommerce' if slot is None else 'freebudget'
+        return self.update(**{field: F(field) + delta})
+
+
 class Appointment(models.Model):
     HOUR_CHOICES = [(datetime.time(hour=x), '{:02d}:00'.format(x)) for x in range(7, 22)]
     id = models.BigAutoField(primary_key=True)
@@ -33,6 +59,11 @@ class Appointment(models.Model):
     planbudget = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)], verbose_name='Бюджет')
     plancommerce = models.PositiveSmallIntegerField(verbose_name='Внебюджет')
     is_slots = models.BooleanField(default=False, verbose_name='Талоны')
+    freebudget = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Свободно (бюджет)')
+    freecommerce = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Свободно (внебюджет)')
+    tickets = models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Выдано талонов')
+
+    objects = AppointmentQuerySet.as_manager()
 
     class Meta:
         managed = True
@@ -40,37 +71,78 @@ class Appointment(models.Model):
         verbose_name_plural = 'Расписание приема'
         verbose_name = 'Строка расписания'
         unique_together = ('dapp', 'specname', 'doctor')
-        index_together = ('dapp', 'specname', 'doctor')
+        indexes = [
+            models.Index(fields=['dapp'], condition=Q(is_slots=True), name='appointment_slots_dapp_idx'),
+            models.Index(fields=['specname', 'dapp'], condition=Q(is_slots=True, freebudget__gt=0),
+                         name='appointment_free_budget_idx'),
+        ]
         ordering = ('-dapp', 'specname', 'doctor')
 
     def doctor_fio(self):
-        fio = f'{self.doctor.last_name} {self.doctor.first_name[0]}.'
-        if self.doctor.profile.patronymic != '-':
-            fio += f'{self.doctor.profile.patronymic[0]}.'
-        return fio
+        return doctor_directory.get(self.doctor_id)
 
     def btckt(self):
-        return Booking.objects.filter(appointment=self.pk, slot__isnull=False, person__isnull=True).count()
+        return self.freebudget
 
     def ctckt(self):
-        return Booking.objects.filter(appointment=self.pk, slot__isnull=True, person__isnull=True).count()
+        return self.freecommerce
 
     def __str__(self):
         return f'Прием врача: {self.dapp:%d.%m.%Y}, {self.specname}, {self.doctor_fio()}'
 
 
+class Timetable(models.Model):
+    WEEKDAY_CHOICES = [(0, 'Понедельник'), (1, 'Вторник'), (2, 'Среда'), (3, 'Четверг'), (4, 'Пятница'),
+                       (5, 'Суббота'), (6, 'Воскресенье')]
+    id = models.BigAutoField(primary_key=True)
+    doctor = models.ForeignKey(User, models.DO_NOTHING, verbose_name='Врач')
+    specname = models.ForeignKey(Specialization, models.DO_NOTHING, verbose_name='Специализация')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES, verbose_name='День недели')
+    room = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)], verbose_name='Кабинет')
+    appbegin = models.TimeField(choices=Appointment.HOUR_CHOICES, verbose_name='Начало')
+    append = models.TimeField(choices=Appointment.HOUR_CHOICES, verbose_name='Окончание')
+    planbudget = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)], verbose_name='Бюджет')
+    plancommerce = models.PositiveSmallIntegerField(verbose_name='Внебюджет')
+    is_active = models.BooleanField(default=True, verbose_name='Действует')
+
+    class Meta:
+        managed = True
+        db_table = 'timetable'
+        verbose_name_plural = 'Шаблоны расписания'
+        verbose_name = 'Шаблон расписания'
+        unique_together = ('doctor', 'specname', 'weekday')
+        ordering = ('doctor', 'specname', 'weekday')
+
+    def doctor_fio(self):
+        return doctor_directory.get(self.doctor_id)
+
+    def appointment(self, dapp):
+        return Appointment(dapp=dapp, specname_id=self.specname_id, doctor_id=self.doctor_id, room=self.room,
+                           appbegin=self.appbegin, append=self.append, planbudget=self.planbudget,
+                           plancommerce=self.plancommerce)
+
+    def __str__(self):
+        return f'{self.get_weekday_display()}, {self.specname}, {self.doctor_fio()}'
+
+
 class Booking(models.Model):
     id = models.BigAutoField(primary_key=True)
     appointment = models.ForeignKey(Appointment, models.DO_NOTHING, verbose_name='Расписание')
     slot = models.TimeField(null=True, blank=True, verbose_name='Время')
-    person = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True, verbose_name='Посетитель')
+    person = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True, db_index=False,
+                               verbose_name='Посетитель')
 
     class Meta:
         managed = True
         db_table = 'booking'
         verbose_name_plural = 'Бронирование'
         verbose_name = 'Талон'
-        index_together = ('appointment', 'slot')
+        indexes = [
+            models.Index(fields=['appointment', 'slot'], name='booking_appointment_slot_idx'),
+            models.Index(fields=['appointment', 'slot'], condition=Q(person__isnull=True), name='booking_free_idx'),
+            models.Index(fields=['person', 'appointment'], condition=Q(person__isnull=False),
+                         name='booking_person_idx'),
+        ]
         ordering = ('appointment', 'slot')
         constraints = [
             models.UniqueConstraint(fields=['appointment', 'person'], condition=models.Q(person__isnull=False),
@@ -78,17 +150,107 @@ class Booking(models.Model):
         ]
 
     def __str__(self):
-        fio = f'{self.appointment.doctor.last_name} {self.appointment.doctor.first_name[0]}.'
-        if self.appointment.doctor.profile.patronymic != '-':
-            fio += f'{self.appointment.doctor.profile.patronymic[0]}.'
         mess = (
             f'Талон {self.appointment.dapp:%d.%m.%Y}, {self.appointment.specname}, '
-            f'{fio}, к.{self.appointment.room} '
+            f'{self.appointment.doctor_fio()}, к.{self.appointment.room} '
             f'({self.appointment.appbegin:%H:%M}-{self.appointment.append:%H:%M})'
         )
         return mess
 
 
+class DaySummary(models.Model):
+    id = models.BigAutoField(primary_key=True)
+    dapp = models.DateField(verbose_name='День приема')
+    specname = models.ForeignKey(Specialization, models.DO_NOTHING, verbose_name='Специализация')
+    doctors = models.PositiveSmallIntegerField(default=0, verbose_name='Врачей')
+    freebudget = models.PositiveIntegerField(default=0, verbose_name='Свободно (бюджет)')
+    freecommerce = models.PositiveIntegerField(default=0, verbose_name='Свободно (внебюджет)')
+
+    class Meta:
+        managed = True
+        db_table = 'day_summary'
+        verbose_name_plural = 'Сводка свободных талонов по дням'
+        verbose_name = 'Сводка дня'
+        unique_together = ('dapp', 'specname')
+        ordering = ('dapp', 'specname')
+
+    def __str__(self):
+        return f'{self.dapp:%d.%m.%Y}, {self.specname}: {self.freebudget}/{self.freecommerce}'
+
+
+class ArchivedAppointment(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    dapp = models.DateField(verbose_name='День приема')
+    specname = models.ForeignKey(Specialization, models.DO_NOTHING, verbose_name='Специализация')
+    doctor = models.ForeignKey(User, models.DO_NOTHING, related_name='+', verbose_name='Врач')
+    room = models.PositiveSmallIntegerField(verbose_name='Кабинет')
+    appbegin = models.TimeField(verbose_name='Начало')
+    append = models.TimeField(verbose_name='Окончание')
+    planbudget = models.PositiveSmallIntegerField(verbose_name='Бюджет')
+    plancommerce = models.PositiveSmallIntegerField(verbose_name='Внебюджет')
+    tickets = models.PositiveSmallIntegerField(default=0, verbose_name='Выдано талонов')
+
+    class Meta:
+        managed = True
+        db_table = 'appointment_archive'
+        verbose_name_plural = 'Архив расписания приема'
+        verbose_name = 'Строка архива расписания'
+        indexes = [models.Index(fields=['-dapp', '-specname', '-doctor'], name='appointment_archive_key_idx')]
+        ordering = ('-dapp', 'specname', 'doctor')
+
+    def doctor_fio(self):
+        return doctor_directory.get(self.doctor_id)
+
+    def __str__(self):
+        return f'Прием врача: {self.dapp:%d.%m.%Y}, {self.specname}, {self.doctor_fio()}'
+
+
+class ArchivedBooking(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    appointment = models.ForeignKey(ArchivedAppointment, models.DO_NOTHING, verbose_name='Расписание')
+    slot = models.TimeField(null=True, blank=True, verbose_name='Время')
+    person = models.ForeignKey(User, models.DO_NOTHING, null=True, blank=True, related_name='+',
+                               verbose_name='Посетитель')
+
+    class Meta:
+        managed = True
+        db_table = 'booking_archive'
+        verbose_name_plural = 'Архив бронирования'
+        verbose_name = 'Талон (архив)'
+        indexes = [models.Index(fields=['person', 'appointment'], name='booking_archive_person_idx')]
+        ordering = ('appointment', 'slot')
+
+    def __str__(self):
+        return (
+            f'Талон {self.appointment.dapp:%d.%m.%Y}, {self.appointment.specname}, '
+            f'{self.appointment.doctor_fio()}, к.{self.appointment.room} '
+            f'({self.appointment.appbegin:%H:%M}-{self.appointment.append:%H:%M})'
+        )
+
+
+class SearchKey(models.Model):
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, verbose_name='Пользователь')
+    key = models.CharField(max_length=301, verbose_name='Ключ поиска')
+
+    class Meta:
+        managed = True
+        db_table = 'search_key'
+        verbose_name_plural = 'Ключи поиска пользователей'
+        verbose_name = 'Ключ поиска пользователя'
+        indexes = [models.Index(fields=['key'], name='search_key_key_idx')]
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join(text.split()).casefold().replace('ё', 'е')
+
+    @classmethod
+    def for_user(cls, user):
+        return cls.normalize(f'{user.last_name} {user.first_name}')
+
+    def __str__(self):
+        return self.key
+
+
 class Profile(models.Model):
     GENDER_CHOICES = [('Ж', 'Женский'), ('М', 'Мужской')]
     id = models.BigAutoField(primary_key=True)
@@ -117,5 +279,48 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_user_search_key(sender, instance, created, update_fields=None, **kwargs):
+    # Подключен раньше save_user_profile: _saved_fio еще содержит ФИО до сохранения (см. forget_doctor_fio).
+    # Сохранение без изменения фамилии и имени (например, last_login при входе) ключ не пишет
+    if update_fields is not None and not {'last_name', 'first_name'} & set(update_fields):
+        return
+    if created or instance._saved_fio != (instance.last_name, instance.first_name):
+        SearchKey.objects.update_or_create(user=instance, defaults={'key': SearchKey.for_user(instance)})
+
+
+@receiver(post_save, sender=User)
+def save_user_profile(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {'last_name', 'first_name'} & set(update_fields):
+        instance.profile.save()
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Profile)
+def remember_doctor_fio(sender, instance, **kwargs):
+    # Без обращения к отложенным полям (only/defer), чтобы не выполнять запрос на каждый экземпляр
+    fields = ('last_name', 'first_name') if sender is User else ('patronymic',)
+    instance._saved_fio = tuple(instance.__dict__.get(name) for name in fields)
+
+
+@receiver(post_save, sender=Profile)
+def forget_doctor_fio(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is not None and 'patronymic' not in update_fields:
+        return
+    user = instance.user
+    saved = user._saved_fio + instance._saved_fio
+    user._saved_fio, instance._saved_fio = (user.last_name, user.first_name), (instance.patronymic,)
+    # Без проверки группы: ФИО могло попасть в справочник и у пользователя, который уже не в группе 'Врачи'
+    if saved != user._saved_fio + instance._saved_fio:
+        doctor_directory.invalidate(instance.user_id)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def forget_doctor_groups(sender, instance, action, reverse, pk_set, **kwargs):
+    # Состав группы 'Врачи' определяет справочник, загружаемый целиком
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        doctor_directory.invalidate(instance.pk)
+    else:
+        doctor_directory.invalidate(*(pk_set or ()))
+
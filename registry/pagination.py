@@ -0,0 +1,243 @@
+import base64
+import json
+from functools import cmp_to_key
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, connection
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+
+AFTER_VAR = 'after'
+BEFORE_VAR = 'before'
+
+
+def seek(keyset, values):
+    """
+    Условие "строка после курсора" для сортировки keyset (поля с '-' - по убыванию) в развернутом виде
+    a > x OR (a = x AND (b > y OR ...)): сравнение строк (a, b) > (x, y) не подходит для ключей со смешанными
+    направлениями. Дополнительное условие a >= x по первому полю задает границу поиска по индексу.
+    """
+    q = None
+    for field, value in reversed(list(zip(keyset, values))):
+        name, op = (field[1:], 'lt') if field.startswith('-') else (field, 'gt')
+        q = Q(**{f'{name}__{op}': value}) if q is None else Q(**{f'{name}__{op}': value}) | Q(**{name: value}) & q
+    name, op = (keyset[0][1:], 'lte') if keyset[0].startswith('-') else (keyset[0], 'gte')
+    return Q(**{f'{name}__{op}': values[0]}) & q
+
+
+def reverse_keyset(keyset):
+    return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in keyset)
+
+
+def estimated_count(model):
+    if connection.vendor != 'sqlite':
+        return None
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [model._meta.db_table])
+            row = cursor.fetchone()
+    except DatabaseError:
+        return None
+    return int(row[0].split()[0]) if row else None
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, previous_cursor, next_cursor):
+        self.object_list = object_list
+        self.previous_cursor = previous_cursor
+        self.next_cursor = next_cursor
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+
+class KeysetPaginator:
+    """Постраничный вывод по ключу сортировки (seek) вместо OFFSET.
+
+    Стоимость страницы не зависит от ее номера, если keyset совпадает с префиксом индекса.
+    """
+
+    def __init__(self, queryset, keyset, per_page):
+        self.queryset = queryset
+        self.keyset = tuple(keyset)
+        self.per_page = per_page
+
+    def fields(self):
+        for path in self.keyset:
+            opts, names = self.queryset.model._meta, path.lstrip('-').split(LOOKUP_SEP)
+            for name in names[:-1]:
+                opts = opts.get_field(name).related_model._meta
+            yield opts.get_field(names[-1])
+
+    def values(self, obj):
+        result = []
+        for path in self.keyset:
+            value = obj
+            for name in path.lstrip('-').split(LOOKUP_SEP):
+                value = getattr(value, name)
+            result.append(value)
+        return result
+
+    def encode(self, obj):
+        values = [value if isinstance(value, int) else str(value) for value in self.values(obj)]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def decode(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.keyset):
+                return None
+            return [field.to_python(value) for field, value in zip(self.fields(), values)]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+    def query(self, after=None, before=None, queryset=None):
+        """Запрос страницы: (queryset, курсор after, признак обратного направления)."""
+        queryset = self.queryset if queryset is None else queryset
+        before = before and self.decode(before)
+        if before:
+            keyset = reverse_keyset(self.keyset)
+            return queryset.filter(seek(keyset, before)).order_by(*keyset)[:self.per_page + 1], None, True
+        after = after and self.decode(after)
+        queryset = queryset.order_by(*self.keyset)
+        if after:
+            queryset = queryset.filter(seek(self.keyset, after))
+        return queryset[:self.per_page + 1], after, False
+
+    def build(self, rows, after, backward):
+        more = len(rows) > self.per_page
+        if backward:
+            rows = rows[:self.per_page][::-1]
+            return KeysetPage(rows, self.encode(rows[0]) if more else None, self.encode(rows[-1]) if rows else None)
+        rows = rows[:self.per_page]
+        return KeysetPage(rows, self.encode(rows[0]) if after and rows else None,
+                          self.encode(rows[-1]) if more else None)
+
+    def page(self, after=None, before=None):
+        queryset, after, backward = self.query(after, before)
+        return self.build(list(queryset), after, backward)
+
+    async def apage(self, after=None, before=None):
+        queryset, after, backward = self.query(after, before)
+        return self.build([obj async for obj in queryset], after, backward)
+
+
+class UnionKeysetPaginator(KeysetPaginator):
+    """Keyset-страницы по нескольким querysets с одинаковыми полями ключа (рабочая и архивная таблицы).
+
+    Из каждого queryset берется не больше страницы, результаты сливаются в порядке ключа.
+    """
+
+    def __init__(self, querysets, keyset, per_page):
+        super().__init__(querysets[0], keyset, per_page)
+        self.querysets = querysets
+
+    def merge(self, rows, backward):
+        keyset = reverse_keyset(self.keyset) if backward else self.keyset
+
+        def compare(a, b):
+            for field, x, y in zip(keyset, self.values(a), self.values(b)):
+                if x != y:
+                    return (-1 if x < y else 1) * (-1 if field.startswith('-') else 1)
+            return 0
+
+        return sorted(rows, key=cmp_to_key(compare))[:self.per_page + 1]
+
+    def page(self, after=None, before=None):
+        rows = []
+        for queryset in self.querysets:
+            queryset, cursor, backward = self.query(after, before, queryset)
+            rows += list(queryset)
+        return self.build(self.merge(rows, backward), cursor, backward)
+
+    async def apage(self, after=None, before=None):
+        rows = []
+        for queryset in self.querysets:
+            queryset, cursor, backward = self.query(after, before, queryset)
+            rows += [obj async for obj in queryset]
+        return self.build(self.merge(rows, backward), cursor, backward)
+
+
+class KeysetTableMixin:
+    """Режим keyset для представлений django_tables2; при сортировке по столбцу - обычные страницы."""
+    keyset = None
+    keyset_per_page = 25
+    keyset_page = None
+
+    def keyset_enabled(self):
+        return self.keyset is not None and 'sort' not in self.request.GET
+
+    def get_table_data(self):
+        data = super().get_table_data()
+        if not self.keyset_enabled():
+            return data
+        paginator = self.get_keyset_paginator(data)
+        self.keyset_page = paginator.page(self.request.GET.get(AFTER_VAR), self.request.GET.get(BEFORE_VAR))
+        return self.keyset_page.object_list
+
+    def get_keyset_paginator(self, data):
+        return KeysetPaginator(data, self.keyset, self.paginate_by or self.keyset_per_page)
+
+    def get_table_pagination(self, table):
+        if self.keyset_page is not None:
+            return False
+        return super().get_table_pagination(table)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['keyset_page'] = self.keyset_page
+        return context
+
+
+class KeysetChangeList(ChangeList):
+    """Список объектов админки с keyset-страницами при сортировке по умолчанию.
+
+    Общее количество берется из статистики SQLite (ANALYZE) и только для списка без фильтров, иначе
+    не показывается.
+    """
+
+    def __init__(self, request, *args, **kwargs):
+        self.after = request.GET.get(AFTER_VAR)
+        self.before = request.GET.get(BEFORE_VAR)
+        self.keyset_page = None
+        self.estimated_count = None
+        super().__init__(request, *args, **kwargs)
+        for var in (AFTER_VAR, BEFORE_VAR):
+            self.params.pop(var, None)
+            self.filter_params.pop(var, None)
+
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        for var in (AFTER_VAR, BEFORE_VAR):
+            lookup_params.pop(var, None)
+        return lookup_params
+
+    def get_results(self, request):
+        if ORDER_VAR in self.params or self.show_all:
+            return super().get_results(request)
+        paginator = KeysetPaginator(self.queryset, self.model_admin.keyset, self.list_per_page)
+        self.keyset_page = paginator.page(self.after, self.before)
+        # Для списка с фильтрами или поиском количество неизвестно и не показывается; result_count (нужен
+        # действиям админки) тогда равен длине страницы, и выбор "всех объектов" не предлагается
+        self.estimated_count = None if self.has_active_filters or self.query else estimated_count(self.model)
+        self.result_count = self.estimated_count if self.estimated_count is not None else len(self.keyset_page)
+        self.full_result_count = None
+        self.show_full_result_count = False
+        self.show_admin_actions = True
+        self.result_list = self.keyset_page.object_list
+        self.can_show_all = False
+        self.multi_page = False
+        self.paginator = paginator
+
+    def keyset_url(self, var, cursor):
+        return self.get_query_string({var: cursor}, [AFTER_VAR, BEFORE_VAR])
+
+    def previous_url(self):
+        return self.keyset_page.previous_cursor and self.keyset_url(BEFORE_VAR, self.keyset_page.previous_cursor)
+
+    def next_url(self):
+        return self.keyset_page.next_cursor and self.keyset_url(AFTER_VAR, self.keyset_page.next_cursor)
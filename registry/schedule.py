@@ -0,0 +1,123 @@
+import datetime
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import Appointment, Specialization
+from .signals import schedule_changed
+
+VERSION_KEY = 'registry:schedule:version:{}'
+
+
+def get_cache():
+    return caches[getattr(settings, 'REGISTRY_SCHEDULE_CACHE', 'default')]
+
+
+class RowsCache:
+    """
+    Строки расписания в памяти процесса по ключу из параметров фильтра и версии расписания. Строки
+    не сериализуются, поэтому попадание в кэш не копирует список целиком; хранится не более
+    REGISTRY_SCHEDULE_ROWS_SIZE последних ключей не дольше REGISTRY_SCHEDULE_TIMEOUT секунд.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = OrderedDict()
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def get(self, key):
+        with self.lock:
+            expires, rows = self.data.get(key, (0, None))
+            if expires < time.monotonic():
+                self.data.pop(key, None)
+                return None
+            self.data.move_to_end(key)
+        # Таблица сортирует строки на месте, поэтому каждому запросу - своя копия списка
+        return list(rows)
+
+    def set(self, key, rows):
+        with self.lock:
+            self.data[key] = (time.monotonic() + getattr(settings, 'REGISTRY_SCHEDULE_TIMEOUT', 300), list(rows))
+            self.data.move_to_end(key)
+            while len(self.data) > getattr(settings, 'REGISTRY_SCHEDULE_ROWS_SIZE', 256):
+                self.data.popitem(last=False)
+
+
+rows_cache = RowsCache()
+
+
+def clear():
+    get_cache().clear()
+    rows_cache.clear()
+
+
+def version(dapp=None):
+    # Только чтение: версия записывается при изменении расписания (touch), а не при его просмотре
+    return get_cache().get(VERSION_KEY.format(dapp or 'all'), 0)
+
+
+async def aversion(dapp=None):
+    return await get_cache().aget(VERSION_KEY.format(dapp or 'all'), 0)
+
+
+def touch(dates):
+    """
+    Новая версия расписания дней dates - целое число секунд, строго больше прежних версий этих дней: версия
+    служит и временем Last-Modified, поэтому два изменения в одну секунду дают разные значения.
+    """
+    cache = get_cache()
+    keys = [VERSION_KEY.format(dapp) for dapp in {*dates, 'all'}]
+    stamp = max([math.ceil(time.time()), *(int(value) + 1 for value in cache.get_many(keys).values())])
+    cache.set_many({key: stamp for key in keys}, None)
+
+
+def queryset():
+    """Строки расписания с талонами начиная с сегодняшнего дня (страница расписания и API)."""
+    return Appointment.objects.filter(is_slots=True, dapp__gte=datetime.date.today()).select_related('specname')
+
+
+def rows_key(cleaned_data, stamp):
+    params = sorted((name, str(getattr(value, 'pk', value))) for name, value in cleaned_data.items() if value)
+    key = repr((params, datetime.date.today().isoformat(), stamp))
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def rows(cleaned_data, load):
+    key = rows_key(cleaned_data, version(cleaned_data.get('dapp')))
+    data = rows_cache.get(key)
+    if data is None:
+        data = list(load())
+        rows_cache.set(key, data)
+    return data
+
+
+async def arows(cleaned_data, queryset):
+    key = rows_key(cleaned_data, await aversion(cleaned_data.get('dapp')))
+    data = rows_cache.get(key)
+    if data is None:
+        data = [rec async for rec in queryset]
+        rows_cache.set(key, data)
+    return data
+
+
+@receiver(schedule_changed)
+def invalidate_schedule(sender, dates, **kwargs):
+    touch(dates)
+
+
+@receiver(post_save, sender=Specialization)
+@receiver(post_delete, sender=Specialization)
+def invalidate_specialization(sender, instance, **kwargs):
+    # Строки расписания в кэше содержат название специализации
+    dates = set(Appointment.objects.filter(specname=instance.pk, dapp__gte=datetime.date.today()).order_by().
+                values_list('dapp', flat=True).distinct())
+    transaction.on_commit(lambda: touch(dates))
@@ -0,0 +1,29 @@
+import logging
+from django.db import transaction
+from django.dispatch import Signal
+from . import summary
+
+logger = logging.getLogger('registry.signals')
+
+# Отправляется после фиксации транзакции, изменившей строки расписания или их талоны.
+# appointments - словарь {код строки расписания: день приема}, dates - все затронутые дни приема.
+schedule_changed = Signal()
+
+
+def send_schedule_changed(sender, appointments, dates):
+    # Транзакция уже зафиксирована, поэтому ошибка получателя не должна превращаться в ошибку запроса
+    for receiver, result in schedule_changed.send_robust(sender=sender, appointments=appointments, dates=dates):
+        if isinstance(result, Exception):
+            logger.error('Ошибка обработки изменения расписания в %r', receiver, exc_info=result)
+
+
+def notify_schedule_changed(sender, appointments, dates=()):
+    """
+    Вызывается внутри транзакции, изменившей расписание: сводка свободных талонов пересчитывается в той же
+    транзакции, остальные получатели schedule_changed уведомляются после ее фиксации.
+    """
+    appointments = dict(appointments)
+    dates = {*appointments.values(), *dates}
+    if dates:
+        summary.refresh(dates)
+        transaction.on_commit(lambda: send_schedule_changed(sender, appointments, dates))
@@ -0,0 +1,209 @@
+import datetime
+from functools import lru_cache
+from django.db import IntegrityError, transaction
+from django.db.models import BigIntegerField, Case, Exists, F, OuterRef, PositiveSmallIntegerField, Value, When
+from .models import Appointment, Booking
+from .signals import notify_schedule_changed
+
+BATCH_SIZE = 1000
+CLAIMED, TAKEN, DUPLICATE, NOT_FOUND, INVALID = 'claimed', 'taken', 'duplicate', 'not_found', 'invalid'
+CLAIM_ATTEMPTS = 5
+
+
+@lru_cache(maxsize=None)
+def time_slots(start_time, end_time, n):
+    start = datetime.datetime.combine(datetime.date.min, start_time)
+    delta = (datetime.datetime.combine(datetime.date.min, end_time) - start) / n
+    return tuple((start + delta * i).time().replace(second=0, microsecond=0) for i in range(n))
+
+
+def appointment_tickets(rec):
+    tickets = [Booking(appointment_id=rec.id) for _ in range(rec.plancommerce)]
+    if rec.planbudget > 0:
+        tickets += [Booking(appointment_id=rec.id, slot=slot)
+                    for slot in time_slots(rec.appbegin, rec.append, rec.planbudget)]
+    return tickets
+
+
+def create_slots(queryset, batch_size=BATCH_SIZE):
+    created = []
+    for rec in list(queryset.filter(is_slots=False).order_by('dapp', 'pk')):
+        with transaction.atomic():
+            if not Appointment.objects.filter(pk=rec.id, is_slots=False).update(
+                    is_slots=True, freebudget=rec.planbudget, freecommerce=rec.plancommerce,
+                    tickets=rec.planbudget + rec.plancommerce):
+                continue
+            Booking.objects.bulk_create(appointment_tickets(rec), batch_size=batch_size)
+            notify_schedule_changed(Appointment, {rec.id: rec.dapp})
+        created.append(rec)
+    return created
+
+
+def delete_slots(queryset):
+    with transaction.atomic():
+        selected = queryset.filter(is_slots=True)
+        booked = Booking.objects.filter(appointment__in=selected.values('pk'), person__isnull=False)
+        skipped = list(selected.filter(pk__in=booked.values('appointment')).select_related('specname'))
+        free = selected.exclude(pk__in=booked.values('appointment'))
+        changed = dict(free.values_list('pk', 'dapp'))
+        Booking.objects.filter(appointment__in=free.values('pk')).delete()
+        deleted = free.update(is_slots=False, freebudget=0, freecommerce=0, tickets=0)
+        notify_schedule_changed(Appointment, changed)
+    return deleted, skipped
+
+
+def cancel_bookings(queryset):
+    with transaction.atomic():
+        cancelled = Booking.objects.filter(pk__in=queryset.values('pk'), person__isnull=False).update(person=None)
+        affected = Appointment.objects.filter(pk__in=queryset.values('appointment'))
+        affected.recount_tickets()
+        notify_schedule_changed(Booking, affected.values_list('pk', 'dapp'))
+    return cancelled
+
+
+def claim_ticket(pk, person):
+    budget = Exists(Booking.objects.filter(pk=pk, slot__isnull=False))
+    counter = PositiveSmallIntegerField()
+    try:
+        with transaction.atomic():
+            if not Booking.objects.filter(pk=pk, person__isnull=True).update(person=person):
+                return TAKEN
+            Appointment.objects.filter(booking=pk).update(
+                freebudget=Case(When(budget, then=F('freebudget') - 1), default=F('freebudget'), output_field=counter),
+                freecommerce=Case(When(budget, then=F('freecommerce')), default=F('freecommerce') - 1,
+                                  output_field=counter))
+            notify_schedule_changed(Booking, Appointment.objects.filter(booking=pk).values_list('pk', 'dapp'))
+    except IntegrityError:
+        return DUPLICATE
+    return CLAIMED
+
+
+def free_tickets(specname, date_from=None, time_from=None, doctor=None, person=None):
+    """
+    Свободные бюджетные талоны специализации в порядке (день приема, время). Строки расписания со свободными
+    бюджетными талонами перебираются по частичному индексу appointment_free_budget_idx в порядке дня приема,
+    талоны каждой строки - по частичному индексу свободных талонов booking_free_idx.
+    Строки, в которых у посетителя person уже есть талон, пропускаются.
+    """
+    today = datetime.date.today()
+    queryset = Booking.objects.filter(person__isnull=True, slot__isnull=False, appointment__specname=specname,
+                                      appointment__is_slots=True, appointment__freebudget__gt=0,
+                                      appointment__dapp__gte=max(date_from or today, today))
+    if time_from is not None:
+        queryset = queryset.filter(slot__gte=time_from)
+    if doctor is not None:
+        queryset = queryset.filter(appointment__doctor=doctor)
+    if person is not None:
+        queryset = queryset.exclude(Exists(Booking.objects.filter(appointment=OuterRef('appointment'), person=person)))
+    return queryset.order_by('appointment__dapp', 'slot', 'pk')
+
+
+def first_free(specname, **kwargs):
+    return free_tickets(specname, **kwargs).select_related('appointment__specname').first()
+
+
+def claim_first(person, specname, attempts=CLAIM_ATTEMPTS, **kwargs):
+    """
+    Бронирование первого свободного талона для person. Если талон успели занять между поиском и бронированием,
+    поиск повторяется (не более attempts раз). Возвращает результат и код талона.
+    """
+    for _ in range(attempts):
+        pk = free_tickets(specname, person=person, **kwargs).values_list('pk', flat=True).first()
+        if pk is None:
+            return NOT_FOUND, None
+        outcome = claim_ticket(pk, person)
+        if outcome != TAKEN:
+            return outcome, pk
+    return TAKEN, None
+
+
+def claim_rows(assigned):
+    """
+    Бронирование талонов {код талона: код посетителя} одним UPDATE. Если часть талонов успели занять
+    (или посетитель успел получить талон той же строки расписания), оставшиеся бронируются по одному.
+    Возвращает коды забронированных талонов.
+    """
+    whens = [When(pk=pk, then=Value(person)) for pk, person in assigned.items()]
+    try:
+        with transaction.atomic():
+            claimed = Booking.objects.filter(pk__in=assigned, person__isnull=True).\
+                update(person=Case(*whens, output_field=BigIntegerField()))
+    except IntegrityError:
+        claimed = 0
+    if claimed == len(assigned):
+        return set(assigned)
+    owners = dict(Booking.objects.filter(pk__in=assigned).values_list('pk', 'person'))
+    result = set()
+    for pk, person in assigned.items():
+        if owners.get(pk) is None:
+            try:
+                with transaction.atomic():
+                    if not Booking.objects.filter(pk=pk, person__isnull=True).update(person=person):
+                        continue
+            except IntegrityError:
+                continue
+        elif owners[pk] != person:
+            continue
+        result.add(pk)
+    return result
+
+
+def claim_batch(items):
+    """
+    Бронирование талонов для списка посетителей в одной транзакции. Элемент items - словарь с кодом посетителя
+    person и кодом талона booking либо кодом строки расписания appointment (тогда выбирается первый свободный
+    бюджетный талон строки не раньше времени slot, если оно задано). Талоны прошедших дней и строк без талонов
+    считаются ненайденными. Талоны подбираются по выборке свободных
+    талонов всех запрошенных строк, бронируются одним UPDATE, счетчики пересчитываются одним UPDATE.
+    Возвращает для каждого элемента результат и код талона.
+    """
+    results = [(NOT_FOUND, None)] * len(items)
+    persons = {item['person'] for item in items}
+    bookings = {item['booking'] for item in items if item.get('booking') is not None}
+    today = datetime.date.today()
+    with transaction.atomic():
+        requested = {pk: (appointment, person) for pk, appointment, person in
+                     Booking.objects.filter(pk__in=bookings, appointment__is_slots=True, appointment__dapp__gte=today).
+                     order_by().values_list('pk', 'appointment', 'person')}
+        free = {}
+        for pk, appointment, slot in Booking.objects.filter(
+                appointment__in={item['appointment'] for item in items if item.get('booking') is None},
+                appointment__is_slots=True, appointment__dapp__gte=today, slot__isnull=False, person__isnull=True).\
+                order_by('appointment_id', 'slot', 'pk').values_list('pk', 'appointment', 'slot'):
+            free.setdefault(appointment, []).append((slot, pk))
+        appointments = {appointment for appointment, _ in requested.values()} | set(free)
+        booked = set(Booking.objects.filter(person__in=persons, appointment__in=appointments).
+                     order_by().values_list('person', 'appointment'))
+        assigned = {}
+        for i, item in enumerate(items):
+            person = item['person']
+            if item.get('booking') is not None:
+                pk = item['booking']
+                if pk not in requested:
+                    continue
+                appointment, owner = requested[pk]
+                if owner is not None or pk in assigned:
+                    results[i] = (TAKEN, pk)
+                    continue
+            else:
+                appointment = item['appointment']
+                pk = next((pk for slot, pk in free.get(appointment, ())
+                           if pk not in assigned and (item.get('slot') is None or slot >= item['slot'])), None)
+                if pk is None:
+                    continue
+            if (person, appointment) in booked:
+                results[i] = (DUPLICATE, None)
+                continue
+            booked.add((person, appointment))
+            assigned[pk] = person
+            results[i] = (CLAIMED, pk)
+        if not assigned:
+            return results
+        claimed = claim_rows(assigned)
+        results = [(TAKEN, pk) if outcome == CLAIMED and pk not in claimed else (outcome, pk)
+                   for outcome, pk in results]
+        affected = Appointment.objects.filter(pk__in=Booking.objects.filter(pk__in=claimed).values('appointment')).\
+            order_by()
+        affected.recount_tickets()
+        notify_schedule_changed(Booking, affected.values_list('pk', 'dapp'))
+    return results
@@ -0,0 +1,46 @@
+from django.db import transaction
+from django.db.models import Count, Sum
+from .models import Appointment, DaySummary
+
+FIELDS = ('doctors', 'freebudget', 'freecommerce')
+
+
+def totals(queryset):
+    return queryset.filter(is_slots=True).order_by().values('dapp', 'specname').\
+        annotate(doctors=Count('pk'), freebudget=Sum('freebudget'), freecommerce=Sum('freecommerce'))
+
+
+def refresh(dates):
+    """
+    Пересчет сводки свободных талонов за дни приема dates одним агрегирующим запросом по строкам расписания
+    с талонами. Строки сводки обновляются на месте, строки дней и специализаций без талонов удаляются.
+    Вызывается из notify_schedule_changed в транзакции, изменившей расписание, поэтому своей транзакции
+    не открывает.
+    """
+    dates = set(dates)
+    if not dates:
+        return 0
+    recs = [DaySummary(dapp=rec['dapp'], specname_id=rec['specname'], **{name: rec[name] for name in FIELDS})
+            for rec in totals(Appointment.objects.filter(dapp__in=dates))]
+    if recs:
+        DaySummary.objects.bulk_create(recs, update_conflicts=True, unique_fields=('dapp', 'specname'),
+                                       update_fields=FIELDS)
+    keep = {(rec.dapp, rec.specname_id) for rec in recs}
+    stale = [pk for pk, *key in DaySummary.objects.filter(dapp__in=dates).order_by().
+             values_list('pk', 'dapp', 'specname_id') if tuple(key) not in keep]
+    DaySummary.objects.filter(pk__in=stale).delete()
+    return len(recs)
+
+
+def rebuild(date_from=None):
+    """Полный пересчет сводки (начиная с дня приема date_from)."""
+    queryset = Appointment.objects.filter(is_slots=True)
+    summary = DaySummary.objects.all()
+    if date_from:
+        queryset = queryset.filter(dapp__gte=date_from)
+        summary = summary.filter(dapp__gte=date_from)
+    dates = {*queryset.order_by().values_list('dapp', flat=True).distinct(),
+             *summary.order_by().values_list('dapp', flat=True).distinct()}
+    with transaction.atomic():
+        return refresh(dates)
+
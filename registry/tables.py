@@ -3,11 +3,12 @@ from . models import Appointment, Booking
 
 
 class AppointmentTable(tables.Table):
+    specname = tables.Column(order_by='specname__specname')
     doctor_fio = tables.Column(verbose_name='Врач')
     appbegin = tables.Column()
     append = tables.Column()
-    btckt = tables.Column(verbose_name='Бюджет')
-    ctckt = tables.Column(verbose_name='Внебюджет')
+    btckt = tables.Column(verbose_name='Бюджет', order_by='freebudget')
+    ctckt = tables.Column(verbose_name='Внебюджет', order_by='freecommerce')
     actions = tables.TemplateColumn(verbose_name='', template_name='actionscolumn.html')
 
     class Meta:
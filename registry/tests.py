@@ -1,3 +1,995 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import tempfile
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock, skipIf
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.admin.sites import site
+from django.contrib.auth.models import Group, Permission, User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import IntegrityError, connection
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from polyclinic.db.backends.sqlite3.base import DatabaseWrapper
+from .directory import doctor_directory
+from .live import SlotBroker, slot_broker
+from .middleware import get_budget
+from .models import Specialization, Appointment, ArchivedBooking, Booking, DaySummary, SearchKey, Timetable
+from .pagination import KeysetPaginator
+from .signals import schedule_changed
+from . import archive, backends, checks, export, schedule, slots, summary, timetable
+from .views import BookingListView, MyBookingListView
 
-# Create your tests here.
+
+def create_doctor(username, last_name='Иванов', first_name='Иван', patronymic='Иванович'):
+    doctor = User.objects.create(username=username, last_name=last_name, first_name=first_name)
+    doctor.groups.add(Group.objects.get_or_create(name='Врачи')[0])
+    doctor.profile.patronymic = patronymic
+    doctor.profile.save()
+    return doctor
+
+
+def create_appointments(specname, n, dapp=None):
+    dapp = dapp or datetime.date.today() + datetime.timedelta(days=1)
+    result = []
+    for i in range(n):
+        doctor = create_doctor(f'doctor{specname.pk}_{dapp:%m%d}_{i}')
+        rec = Appointment.objects.create(dapp=dapp, specname=specname, doctor=doctor, room=i + 1,
+                                         appbegin=datetime.time(8), append=datetime.time(12),
+                                         planbudget=2, plancommerce=1, is_slots=True)
+        Booking.objects.create(appointment=rec, slot=datetime.time(8))
+        Booking.objects.create(appointment=rec, slot=datetime.time(10))
+        Booking.objects.create(appointment=rec)
+        result.append(rec)
+    Appointment.objects.filter(pk__in=[rec.pk for rec in result]).recount_tickets()
+    return result
+
+
+class QueryBudgetMixin:
+
+    def assertWithinQueryBudget(self, view_name, *args, **kwargs):
+        # Бюджет - для установившегося режима: первый запрос заполняет кэши (права, справочник врачей, расписание)
+        budget = get_budget(view_name)
+        self.client.get(reverse(view_name, args=args), kwargs)
+        response = self.client.get(reverse(view_name, args=args), kwargs)
+        self.assertEqual(response.status_code, 200)
+        recorder = response.query_stats
+        self.assertLessEqual(recorder.count, budget, f'{view_name}: {recorder.count} > {budget}')
+        self.assertFalse(recorder.duplicates, view_name)
+        return response
+
+
+class AppointmentListViewTest(TestCase):
+
+    def setUp(self):
+        schedule.clear()
+
+    def count_queries(self):
+        schedule.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse('appointment'))
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def test_free_tickets(self):
+        rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        Booking.objects.filter(appointment=rec, slot=datetime.time(8)).update(person=create_doctor('patient'))
+        with self.assertRaises(CommandError):
+            call_command('recount_tickets', '--check', stdout=StringIO())
+        with self.assertRaises(CommandError):
+            call_command('recount_tickets', '--from', '2030-13-01', stdout=StringIO())
+        call_command('recount_tickets', '--from', rec.dapp.isoformat(), stdout=StringIO())
+        rec.refresh_from_db()
+        self.assertEqual((rec.btckt(), rec.ctckt(), rec.tickets), (1, 1, 3))
+
+    def test_query_count_does_not_depend_on_rows(self):
+        create_appointments(Specialization.objects.create(specname='Терапевт'), 2)
+        expected = self.count_queries()
+        create_appointments(Specialization.objects.create(specname='Хирург'), 10)
+        self.assertEqual(self.count_queries(), expected)
+
+    def test_cache_invalidation(self):
+        rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        url = reverse('appointment')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertFalse([query for query in ctx.captured_queries if '"appointment"' in query['sql']])
+        self.assertEqual(response.context['table'].rows[0].get_cell('btckt'), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            slots.claim_ticket(Booking.objects.filter(appointment=rec, slot__isnull=False)[0].pk,
+                               create_doctor('patient'))
+        response = self.client.get(url)
+        self.assertEqual(response.context['table'].rows[0].get_cell('btckt'), 1)
+
+
+class SlotsTest(TestCase):
+
+    def test_time_slots(self):
+        self.assertEqual(slots.time_slots(datetime.time(8), datetime.time(9), 4),
+                         (datetime.time(8), datetime.time(8, 15), datetime.time(8, 30), datetime.time(8, 45)))
+        self.assertEqual(len(slots.time_slots(datetime.time(8), datetime.time(9), 7)), 7)
+
+    def test_create_slots(self):
+        specname = Specialization.objects.create(specname='Терапевт')
+        dapp = datetime.date.today() + datetime.timedelta(days=1)
+        for i in range(3):
+            Appointment.objects.create(dapp=dapp, specname=specname, doctor=create_doctor(f'doctor{i}'), room=1,
+                                       appbegin=datetime.time(8), append=datetime.time(12),
+                                       planbudget=8, plancommerce=2)
+        call_command('create_slots', dapp.isoformat(), dapp.isoformat(), stdout=StringIO())
+        self.assertEqual(Booking.objects.count(), 30)
+        self.assertEqual(Booking.objects.filter(slot=datetime.time(11, 30)).count(), 3)
+        self.assertFalse(Appointment.objects.exclude(is_slots=True, freebudget=8, freecommerce=2, tickets=10).exists())
+        self.assertEqual(slots.create_slots(Appointment.objects.all()), [])
+
+    def test_delete_slots_and_cancel_bookings(self):
+        booked, free = create_appointments(Specialization.objects.create(specname='Терапевт'), 2)
+        Booking.objects.filter(appointment=booked, slot__isnull=True).update(person=create_doctor('patient'))
+        with self.assertNumQueries(9):
+            deleted, skipped = slots.delete_slots(Appointment.objects.all())
+        self.assertEqual((deleted, skipped), (1, [booked]))
+        self.assertFalse(Booking.objects.filter(appointment=free).exists())
+        with self.assertNumQueries(8):
+            self.assertEqual(slots.cancel_bookings(Booking.objects.all()), 1)
+        booked.refresh_from_db()
+        self.assertEqual((booked.freebudget, booked.freecommerce), (2, 1))
+
+    def test_claim_ticket(self):
+        rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        patient = create_doctor('patient')
+        first, second = Booking.objects.filter(appointment=rec, slot__isnull=False)
+        with self.assertNumQueries(8):
+            self.assertEqual(slots.claim_ticket(first.pk, patient), slots.CLAIMED)
+        self.assertEqual(slots.claim_ticket(first.pk, create_doctor('other')), slots.TAKEN)
+        self.assertEqual(slots.claim_ticket(second.pk, patient), slots.DUPLICATE)
+        rec.refresh_from_db()
+        self.assertEqual((rec.freebudget, rec.freecommerce), (1, 1))
+
+
+    def test_admin_assignment(self):
+        rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        ticket = Booking.objects.get(appointment=rec, slot=datetime.time(8))
+        model_admin = site._registry[Booking]
+        form = SimpleNamespace(changed_data=['person'])
+        # Два параллельных сохранения одного свободного талона
+        first, second = Booking.objects.get(pk=ticket.pk), Booking.objects.get(pk=ticket.pk)
+        first.person, second.person = create_doctor('patient'), create_doctor('other')
+        model_admin.save_model(None, first, form, True)
+        with self.assertRaises(IntegrityError):
+            model_admin.save_model(None, second, form, True)
+        rec.refresh_from_db()
+        self.assertEqual((rec.freebudget, rec.freecommerce), (1, 1))
+        self.assertEqual(Booking.objects.get(pk=ticket.pk).person, first.person)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        other = Booking.objects.get(appointment=rec, slot=datetime.time(10))
+        response = self.client.post(reverse('admin:registry_booking_change', args=[other.pk]),
+                                    {'person': second.person.pk})
+        self.assertEqual(response.status_code, 302)
+        rec.refresh_from_db()
+        self.assertEqual((rec.freebudget, Booking.objects.get(pk=other.pk).person), (0, second.person))
+
+
+class TimetableTest(TestCase):
+
+    def test_materialize(self):
+        specname = Specialization.objects.create(specname='Терапевт')
+        doctor = create_doctor('doctor')
+        for weekday in (0, 2):
+            Timetable.objects.create(doctor=doctor, specname=specname, weekday=weekday, room=1,
+                                     appbegin=datetime.time(8), append=datetime.time(12), planbudget=4, plancommerce=1)
+        monday = datetime.date(2030, 1, 7)
+        Appointment.objects.create(dapp=monday, specname=specname, doctor=doctor, room=2,
+                                   appbegin=datetime.time(14), append=datetime.time(16), planbudget=1, plancommerce=0)
+        with self.assertNumQueries(5):
+            count, created = timetable.materialize(monday, monday + datetime.timedelta(days=20))
+        self.assertEqual((count, created), (5, []))
+        self.assertEqual(Appointment.objects.get(dapp=monday).room, 2)
+        count, created = timetable.materialize(monday, monday + datetime.timedelta(days=27), tickets=True)
+        self.assertEqual(count, 2)
+        self.assertEqual([rec.dapp for rec in created], [datetime.date(2030, 1, 28), datetime.date(2030, 1, 30)])
+        self.assertEqual(Booking.objects.count(), 10)
+        call_command('materialize', monday.isoformat(), '2030-02-28', '--slots', stdout=StringIO())
+        self.assertEqual(Appointment.objects.count(), 16)
+        self.assertEqual(Appointment.objects.filter(is_slots=True).count(), 10)
+
+    def test_concurrent_rows_not_counted(self):
+        specname = Specialization.objects.create(specname='Терапевт')
+        doctor = create_doctor('doctor')
+        template = Timetable.objects.create(doctor=doctor, specname=specname, weekday=0, room=1,
+                                            appbegin=datetime.time(8), append=datetime.time(12),
+                                            planbudget=4, plancommerce=1)
+        monday = datetime.date(2030, 1, 7)
+        template.appointment(monday).save()
+        recs = [template.appointment(monday), template.appointment(monday + datetime.timedelta(days=7))]
+        self.assertEqual([rec.dapp for rec in timetable.insert(recs)], [monday + datetime.timedelta(days=7)])
+        self.assertEqual(Appointment.objects.count(), 2)
+
+
+class DoctorDirectoryTest(TestCase):
+
+    def test_invalidation(self):
+        rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        self.assertEqual(rec.doctor_fio(), 'Иванов И.И.')
+        with self.assertNumQueries(0):
+            rec.doctor_fio()
+        rec.doctor.profile.patronymic = '-'
+        rec.doctor.profile.save()
+        self.assertEqual(rec.doctor_fio(), 'Иванов И.')
+
+    def test_unchanged_names_keep_directory(self):
+        doctor = create_doctor('doctor')
+        patient = create_doctor('patient', last_name='Петров')
+        patient.groups.clear()
+        self.assertEqual(doctor_directory.get(doctor.pk), 'Иванов И.И.')
+        with mock.patch.object(doctor_directory, 'invalidate') as invalidate:
+            self.client.force_login(doctor)
+            User.objects.get(pk=doctor.pk).save()
+            self.assertFalse(invalidate.called)
+            doctor.first_name = 'Петр'
+            doctor.save()
+            invalidate.assert_called_once_with(doctor.pk)
+
+    def test_former_doctor(self):
+        doctor = create_doctor('doctor')
+        doctor.groups.clear()
+        self.assertEqual(doctor_directory.get(doctor.pk), 'Иванов И.И.')
+        doctor.last_name = 'Петров'
+        doctor.save()
+        self.assertEqual(doctor_directory.get(doctor.pk), 'Петров И.И.')
+
+    def test_group_changes(self):
+        doctor = create_doctor('doctor')
+        patient = User.objects.create(username='patient', last_name='Петров', first_name='Петр')
+        group = Group.objects.get(name='Врачи')
+        with mock.patch.object(doctor_directory, 'invalidate') as invalidate:
+            doctor.groups.remove(group)
+            invalidate.assert_called_once_with(doctor.pk)
+            invalidate.reset_mock()
+            group.user_set.add(doctor, patient)
+            invalidate.assert_called_once_with(*{doctor.pk, patient.pk})
+
+    def test_concurrent_clear(self):
+        doctor = create_doctor('doctor')
+        load = doctor_directory.load
+
+        def load_and_clear(*user_ids):
+            names = load(*user_ids)
+            doctor_directory.clear()
+            return names
+
+        doctor_directory.clear()
+        with mock.patch.object(doctor_directory, 'load', load_and_clear):
+            self.assertEqual(doctor_directory.get(doctor.pk), 'Иванов И.И.')
+
+
+@override_settings(REGISTRY_DIRECTORY_TIMEOUT=3600)
+class BookingListQueriesTest(TestCase):
+
+    def setUp(self):
+        # Версия справочника врачей сверяется с общим кэшем только в первом запросе теста
+        doctor_directory.checked = 0.0
+        self.patient = create_doctor('patient')
+        self.patient.user_permissions.add(Permission.objects.get(codename='view_booking'))
+
+    def book(self, specname, n):
+        for rec in create_appointments(Specialization.objects.create(specname=specname), n):
+            Booking.objects.filter(appointment=rec, slot__isnull=True).update(person=self.patient)
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertQueriesDoNotDependOnRows(self, url):
+        # первый запрос после изменения данных заполняет кэши (права пользователя, справочник врачей)
+        self.book('Терапевт', 2)
+        self.count_queries(url)
+        expected = self.count_queries(url)
+        self.book('Хирург', 10)
+        self.count_queries(url)
+        self.assertEqual(self.count_queries(url), expected)
+
+    def test_booking_admin(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        self.assertQueriesDoNotDependOnRows(reverse('admin:registry_booking_changelist'))
+
+    def test_mybooking(self):
+        self.client.force_login(self.patient)
+        self.assertQueriesDoNotDependOnRows(reverse('mybooking'))
+
+
+class AutocompleteTest(TestCase):
+
+    def test_cyrillic_prefix(self):
+        for i, last_name in enumerate(['Ёлкин', 'Елисеев', 'Ежов', 'Иванов']):
+            create_doctor(f'doctor{i}', last_name=last_name)
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        response = self.client.get(reverse('select2_fk_doctor'), {'q': 'ел'})
+        self.assertEqual([row['text'].split()[0] for row in response.json()['results']], ['Елисеев', 'Ёлкин'])
+        self.assertFalse(response.json()['pagination']['more'])
+
+    def test_search_key_only_on_name_change(self):
+        doctor = create_doctor('doctor', last_name='Иванов')
+        doctor = User.objects.get(pk=doctor.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            doctor.save(update_fields=['last_login'])
+            doctor.save()
+        self.assertFalse([query for query in ctx.captured_queries if 'search_key' in query['sql']])
+        doctor.last_name = 'Ежов'
+        doctor.save()
+        self.assertEqual(SearchKey.objects.get(user=doctor).key, SearchKey.for_user(doctor))
+
+
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        specname = Specialization.objects.create(specname='Терапевт')
+        for day in range(1, 6):
+            create_appointments(specname, 3, datetime.date.today() + datetime.timedelta(days=day))
+
+    def walk(self, url, key):
+        pages, params = [], {}
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            cl = response.context['cl']
+            pages.append([getattr(obj, key) for obj in cl.result_list])
+            if not cl.keyset_page.next_cursor:
+                return pages
+            params = {'after': cl.keyset_page.next_cursor}
+
+    def test_appointment_admin(self):
+        expected = list(Appointment.objects.order_by('-dapp', '-specname_id', '-doctor_id').values_list('pk', flat=True))
+        model_admin = site._registry[Appointment]
+        model_admin.list_per_page = 4
+        try:
+            pages = self.walk(reverse('admin:registry_appointment_changelist'), 'pk')
+        finally:
+            del model_admin.list_per_page
+        self.assertEqual([len(page) for page in pages], [4, 4, 4, 3])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_filtered_count_unknown(self):
+        model_admin = site._registry[Appointment]
+        model_admin.list_per_page = 4
+        try:
+            response = self.client.get(reverse('admin:registry_appointment_changelist'),
+                                       {'specname__id__exact': Specialization.objects.get().pk})
+        finally:
+            del model_admin.list_per_page
+        cl = response.context['cl']
+        self.assertEqual((len(cl.result_list), cl.estimated_count), (4, None))
+        self.assertNotContains(response, f'4 {Appointment._meta.verbose_name_plural}')
+
+    def test_cursor_seeks(self):
+        paginator = KeysetPaginator(Booking.objects.all(), site._registry[Booking].keyset, 10)
+        first = paginator.page()
+        second = paginator.page(after=first.next_cursor)
+        self.assertEqual(paginator.page(before=second.previous_cursor).object_list, first.object_list)
+        with CaptureQueriesContext(connection) as ctx:
+            paginator.page(after=second.next_cursor)
+        self.assertNotIn('OFFSET', ctx.captured_queries[0]['sql'])
+
+
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        schedule.clear()
+        doctor_directory.clear()
+        self.patient = patient = create_doctor('patient')
+        patient.user_permissions.add(Permission.objects.get(codename='view_booking'))
+        for rec in create_appointments(Specialization.objects.create(specname='Терапевт'), 3):
+            Booking.objects.filter(appointment=rec, slot__isnull=True).update(person=patient)
+        # Права пользователя уже в общем кэше, как у любого запроса после первого
+        User.objects.get(pk=patient.pk).has_perm('registry.view_booking')
+        self.client.force_login(patient)
+        self.async_client.force_login(patient)
+
+    def test_budgets(self):
+        self.assertWithinQueryBudget('appointment')
+        self.assertWithinQueryBudget('appointment', dapp=datetime.date.today() + datetime.timedelta(days=1))
+        self.assertWithinQueryBudget('mybooking')
+        # Бюджет не зависит от количества строк: N+1 его превысит
+        with self.captureOnCommitCallbacks(execute=True):
+            for rec in create_appointments(Specialization.objects.create(specname='Хирург'), 10):
+                Booking.objects.filter(appointment=rec, slot__isnull=True).update(person=self.patient)
+        self.assertWithinQueryBudget('appointment')
+        self.assertWithinQueryBudget('mybooking')
+
+    async def test_async_budgets(self):
+        for name in ('appointment_async', 'mybooking_async'):
+            await self.async_client.get(reverse(name))
+            response = await self.async_client.get(reverse(name))
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(response.query_stats.count, get_budget(name), name)
+
+    @override_settings(DEBUG=True, REGISTRY_QUERY_BUDGETS={'mybooking': 1})
+    def test_exceeded(self):
+        with self.assertLogs('registry.queries', 'WARNING'):
+            response = self.client.get(reverse('mybooking'))
+        self.assertEqual(response['X-Query-Budget-Exceeded'], '1')
+        self.assertGreater(int(response['X-Query-Count']), 1)
+
+
+class SharedCacheCheckTest(SimpleTestCase):
+
+    def test_local_cache_refused(self):
+        self.assertEqual(checks.check_shared_caches(None), [])
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                               REGISTRY_SCHEDULE_CACHE='default', REGISTRY_DIRECTORY_CACHE='missing',
+                               REGISTRY_PERMISSION_CACHE='default'):
+            self.assertEqual([error.id for error in checks.check_shared_caches(None)],
+                             ['registry.E002', 'registry.E001', 'registry.E002'])
+
+
+class CacheTableTest(TestCase):
+
+    def test_created_after_migrate(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE registry_cache')
+        emit_post_migrate_signal(0, False, 'default')
+        self.assertIn('registry_cache', connection.introspection.table_names())
+
+
+class ProductionDatabaseTest(SimpleTestCase):
+
+    def test_pragmas_and_transaction_mode(self):
+        handler = ConnectionHandler({'default': {
+            'ENGINE': 'polyclinic.db.backends.sqlite3', 'NAME': ':memory:',
+            'OPTIONS': {'transaction_mode': 'immediate', 'pragmas': {'cache_size': -1024, 'busy_timeout': 1234}}}})
+        wrapper = handler['default']
+        self.assertIsInstance(wrapper, DatabaseWrapper)
+        try:
+            with wrapper.cursor() as cursor:
+                self.assertEqual(cursor.execute('PRAGMA busy_timeout').fetchone()[0], 1234)
+                self.assertEqual(cursor.execute('PRAGMA cache_size').fetchone()[0], -1024)
+            with CaptureQueriesContext(wrapper) as ctx:
+                wrapper._start_transaction_under_autocommit()
+                wrapper.rollback()
+            self.assertEqual(ctx.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+        finally:
+            wrapper.close()
+
+
+class AsyncViewsTest(TestCase):
+
+    def setUp(self):
+        schedule.clear()
+        self.patient = create_doctor('patient', last_name='Петров')
+        self.patient.user_permissions.add(Permission.objects.get(codename='view_booking'))
+        self.recs = create_appointments(Specialization.objects.create(specname='Терапевт'), 3)
+        for rec in self.recs:
+            Booking.objects.filter(appointment=rec, slot__isnull=True).update(person=self.patient)
+
+    def table_rows(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [row.record.pk for row in response.context['table'].rows]
+
+    async def test_same_content_as_sync_views(self):
+        await self.async_client.aforce_login(self.patient)
+        await self.client.aforce_login(self.patient)
+        for name, args in [('appointment', []), ('booking', [self.recs[0].pk]), ('mybooking', [])]:
+            response = await self.async_client.get(reverse(f'{name}_async', args=args))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row.record.pk for row in response.context['table'].rows],
+                             await sync_to_async(self.table_rows)(reverse(name, args=args)))
+        response = await self.async_client.get(reverse('select2_fk_doctor_async'), {'q': 'ив'})
+        self.assertEqual(len(response.json()['results']), 3)
+
+    async def test_permission_denied(self):
+        user = await sync_to_async(create_doctor)('nobody')
+        await self.async_client.aforce_login(user)
+        response = await self.async_client.get(reverse('mybooking_async'))
+        self.assertEqual(response.status_code, 403)
+
+
+class SlotBrokerTest(TestCase):
+
+    def setUp(self):
+        self.rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 1)[0]
+        self.first, self.second = Booking.objects.filter(appointment=self.rec, slot__isnull=False).\
+            values_list('pk', flat=True)
+        self.patient = create_doctor('patient')
+        self.patient.user_permissions.add(Permission.objects.get(codename='view_booking'))
+
+    def take(self, broker, pk):
+        Booking.objects.filter(pk=pk).update(person=self.patient)
+        with self.assertNumQueries(1):
+            broker.publish([self.rec.pk])
+
+    async def test_fan_out(self):
+        broker = SlotBroker()
+        subscriptions = [await broker.subscribe(self.rec.pk) for _ in range(3)]
+        self.assertEqual(subscriptions[0][1]['free'], [self.first, self.second])
+        await sync_to_async(self.take)(broker, self.first)
+        for queue, _ in subscriptions:
+            event = await asyncio.wait_for(queue.get(), 1)
+            self.assertEqual(event, {'free': [self.second], 'taken': [self.first], 'freed': []})
+        for queue, _ in subscriptions:
+            broker.unsubscribe(self.rec.pk, queue)
+        self.assertEqual((broker.watchers, broker.free), ({}, {}))
+
+    async def test_events_view(self):
+        await self.async_client.aforce_login(self.patient)
+        response = await self.async_client.get(reverse('booking_events', args=[self.rec.pk]))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        chunk = await anext(stream)
+        waiting = asyncio.ensure_future(anext(stream))
+        await asyncio.sleep(0)
+        waiting.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await waiting
+        self.assertEqual(slot_broker.watchers, {})
+        event, data = chunk.decode().split('\n')[:2]
+        self.assertEqual(event, 'event: slots')
+        self.assertEqual(json.loads(data[len('data: '):])['free'], [self.first, self.second])
+
+
+class BookingExportTest(TestCase):
+
+    def setUp(self):
+        specname = Specialization.objects.create(specname='Терапевт')
+        dapp = datetime.date.today() + datetime.timedelta(days=1)
+        for i, rec in enumerate(create_appointments(specname, 3, dapp)):
+            patient = create_doctor(f'patient{i}', last_name=f'Петров{i}')
+            Booking.objects.filter(appointment=rec, slot=datetime.time(8)).update(person=patient)
+        self.params = {'date_from': dapp.isoformat(), 'date_to': dapp.isoformat()}
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        self.async_client.force_login(admin)
+
+    def test_csv(self):
+        response = self.client.get(reverse('booking_export'), self.params)
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split(';')[5:7], ['08:00', 'Петров0'])
+
+    async def test_csv_asgi(self):
+        response = await self.async_client.get(reverse('booking_export'), self.params)
+        self.assertTrue(response.is_async)
+        lines = b''.join([chunk async for chunk in response.streaming_content]).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[1].split(';')[5:7], ['08:00', 'Петров0'])
+
+    async def test_file_blocks_asgi(self):
+        with tempfile.TemporaryFile() as output:
+            output.write(b'x' * 10)
+            output.seek(0)
+            self.assertEqual([block async for block in export.ablocks(output, 4)], [b'xxxx', b'xxxx', b'xx'])
+
+    @skipIf(export.openpyxl is None, 'openpyxl не установлен')
+    async def test_xlsx_asgi(self):
+        response = await self.async_client.get(reverse('booking_export'), {**self.params, 'format': 'xlsx'})
+        self.assertTrue(response.is_async)
+        content = b''.join([block async for block in response.streaming_content])
+        self.assertEqual(int(response['Content-Length']), len(content))
+        self.assertTrue(content.startswith(b'PK'))
+
+    def test_invalid_params(self):
+        response = self.client.get(reverse('booking_export'), {'date_from': '2030-01-02', 'date_to': '2030-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_admin_action(self):
+        response = self.client.post(reverse('admin:registry_booking_changelist'), {
+            'action': 'export_csv', '_selected_action': Booking.objects.values_list('pk', flat=True)})
+        lines = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(len(lines), 10)
+
+
+class ArchiveTest(TestCase):
+
+    def setUp(self):
+        self.patient = create_doctor('patient')
+        self.patient.user_permissions.add(Permission.objects.get(codename='view_booking'))
+        specname = Specialization.objects.create(specname='Терапевт')
+        today = datetime.date.today()
+        for days in (-200, -120, -100, 5):
+            for rec in create_appointments(specname, 2, today + datetime.timedelta(days=days)):
+                Booking.objects.filter(appointment=rec, slot__isnull=True).update(person=self.patient)
+
+    def test_archive(self):
+        expected = list(Booking.objects.filter(person=self.patient).order_by(*MyBookingListView.keyset).
+                        values_list('pk', flat=True))
+        self.assertEqual(archive.archive(batch_size=4), (6, 18))
+        self.assertEqual(Appointment.objects.count(), 2)
+        self.assertEqual(ArchivedBooking.objects.filter(person=self.patient).count(), 6)
+        self.assertEqual(archive.archive(), (0, 0))
+        self.client.force_login(self.patient)
+        pages, params = [], {}
+        MyBookingListView.keyset_per_page = 3
+        try:
+            while True:
+                page = self.client.get(reverse('mybooking'), params).context['keyset_page']
+                pages.append([rec.pk for rec in page])
+                if not page.next_cursor:
+                    break
+                params = {'after': page.next_cursor}
+            previous = self.client.get(reverse('mybooking'), {'before': page.previous_cursor}).context['keyset_page']
+        finally:
+            del MyBookingListView.keyset_per_page
+        self.assertEqual(sum(pages, []), expected)
+        self.assertEqual([rec.pk for rec in previous], pages[-2])
+
+    def test_admin(self):
+        archive.archive()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for name, count in (('archivedappointment', 6), ('archivedbooking', 18)):
+            response = self.client.get(reverse(f'admin:registry_{name}_changelist'))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), count)
+
+
+class QueryPlanTest(TestCase):
+    """Горячие запросы должны идти по своим индексам (EXPLAIN QUERY PLAN SQLite)."""
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(f'USING INDEX {index} ', plan)
+        self.assertNotRegex(plan, r'SCAN (appointment|booking)\b')
+
+    def test_hot_queries(self):
+        today = datetime.date.today()
+        view = BookingListView(kwargs={'pk': 1})
+        mine = KeysetPaginator(MyBookingListView(request=SimpleNamespace(user=1)).get_queryset(),
+                               MyBookingListView.keyset, 25)
+        self.assertUsesIndex(Appointment.objects.filter(is_slots=True, dapp__gte=today), 'appointment_slots_dapp_idx')
+        self.assertUsesIndex(view.get_queryset(), 'booking_free_idx')
+        self.assertUsesIndex(mine.query()[0], 'booking_person_idx')
+        self.assertUsesIndex(Booking.objects.filter(appointment__in=[1, 2], slot__isnull=False, person__isnull=True).
+                             order_by(), 'booking_free_idx')
+        self.assertUsesIndex(Booking.objects.filter(appointment=1, slot__isnull=True, person__isnull=True).order_by(),
+                             'booking_free_idx')
+
+
+class ScheduleApiTest(TestCase):
+
+    def setUp(self):
+        schedule.clear()
+        self.rec = create_appointments(Specialization.objects.create(specname='Терапевт'), 2)[0]
+
+    def test_conditional_get(self):
+        url = reverse('schedule_api')
+        params = {'dapp': self.rec.dapp.isoformat()}
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url, params)
+        # Просмотр расписания общий кэш только читает
+        self.assertFalse([query for query in ctx.captured_queries if 'registry_cache' in query['sql'] and
+                          not query['sql'].startswith('SELECT')])
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertEqual(response.json()['results'][1]['freebudget'], 2)
+        etag = response['ETag']
+        self.assertFalse(etag.startswith('W/'))
+        with self.assertNumQueries(1):
+            response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            slots.claim_ticket(Booking.objects.filter(appointment=self.rec, slot__isnull=False)[0].pk,
+                               create_doctor('patient'))
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        response = self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_changes_within_one_second(self):
+        url = reverse('schedule_api')
+        params = {'dapp': self.rec.dapp.isoformat()}
+        with mock.patch.object(time, 'time', return_value=1_900_000_000.2):
+            schedule.touch([self.rec.dapp])
+            last_modified = self.client.get(url, params)['Last-Modified']
+            schedule.touch([self.rec.dapp])
+        response = self.client.get(url, params, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['Last-Modified'], last_modified)
+
+    def test_specialization_renamed(self):
+        url = reverse('schedule_api')
+        self.assertEqual(self.client.get(url).json()['results'][0]['specname'], 'Терапевт')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rec.specname.specname = 'Педиатр'
+            self.rec.specname.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['specname'], 'Педиатр')
+
+    def test_changed_in_other_process(self):
+        url = reverse('schedule_api')
+        params = {'dapp': self.rec.dapp.isoformat()}
+        etag = self.client.get(url, params)['ETag']
+        # Отдельный экземпляр кэша, как в другом процессе
+        other = caches.create_connection(settings.REGISTRY_SCHEDULE_CACHE)
+        other.set(schedule.VERSION_KEY.format(self.rec.dapp), schedule.version(self.rec.dapp) + 1, None)
+        response = self.client.get(url, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_invalid_filter(self):
+        self.assertEqual(self.client.get(reverse('schedule_api'), {'specname': 'x'}).status_code, 400)
+
+
+class DaySummaryTest(QueryBudgetMixin, TestCase):
+
+    def setUp(self):
+        self.specname = Specialization.objects.create(specname='Терапевт')
+        self.recs = create_appointments(self.specname, 2)
+        summary.rebuild()
+
+    def test_refresh(self):
+        rec = DaySummary.objects.get()
+        self.assertEqual((rec.dapp, rec.doctors, rec.freebudget, rec.freecommerce), (self.recs[0].dapp, 2, 4, 2))
+        # Сводка обновляется в транзакции, изменившей расписание, до ее фиксации
+        slots.claim_ticket(Booking.objects.filter(appointment=self.recs[0], slot__isnull=False)[0].pk,
+                           create_doctor('patient'))
+        rec.refresh_from_db()
+        self.assertEqual((rec.freebudget, rec.freecommerce), (3, 2))
+        slots.delete_slots(Appointment.objects.filter(pk=self.recs[1].pk))
+        rec.refresh_from_db()
+        self.assertEqual((rec.doctors, rec.freebudget), (1, 1))
+        slots.cancel_bookings(Booking.objects.filter(person__isnull=False))
+        slots.delete_slots(Appointment.objects.all())
+        self.assertFalse(DaySummary.objects.exists())
+
+    def test_receiver_error_after_commit(self):
+        def fail(**kwargs):
+            raise RuntimeError('receiver failed')
+
+        schedule_changed.connect(fail)
+        self.addCleanup(schedule_changed.disconnect, fail)
+        pk = Booking.objects.filter(appointment=self.recs[0], slot__isnull=False)[0].pk
+        with self.assertLogs('registry.signals', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(slots.claim_ticket(pk, create_doctor('patient')), slots.CLAIMED)
+        self.assertEqual(DaySummary.objects.get().freebudget, 3)
+
+    def test_calendar(self):
+        response = self.assertWithinQueryBudget('calendar')
+        self.assertContains(response, f'dapp={self.recs[0].dapp:%Y-%m-%d}&amp;specname={self.specname.pk}')
+        count = response.query_stats.count
+        for i in range(3):
+            create_appointments(Specialization.objects.create(specname=f'Хирург{i}'), 2,
+                                datetime.date.today() + datetime.timedelta(days=i + 2))
+        summary.rebuild()
+        response = self.assertWithinQueryBudget('calendar', weeks=2, specname=self.specname.pk)
+        self.assertEqual(response.query_stats.count, count + 1)
+        self.assertEqual(len(response.context['weeks']), 2)
+        self.assertEqual(self.client.get(reverse('calendar'), {'weeks': 13}).context['weeks'], [])
+
+    def test_query_plan(self):
+        today = datetime.date.today()
+        plan = DaySummary.objects.filter(dapp__range=(today, today + datetime.timedelta(weeks=4))).explain()
+        self.assertIn('USING INDEX', plan)
+        self.assertNotRegex(plan, r'SCAN day_summary\b')
+
+
+class FirstFreeTest(TestCase):
+
+    def setUp(self):
+        self.specname = Specialization.objects.create(specname='Терапевт')
+        self.recs = create_appointments(self.specname, 2)
+        self.later = create_appointments(self.specname, 1, datetime.date.today() + datetime.timedelta(days=3))[0]
+        self.patient = create_doctor('patient', last_name='Петров')
+        self.patient.user_permissions.add(*Permission.objects.filter(codename__in=['view_booking', 'change_booking']))
+
+    def test_first_free(self):
+        first = slots.first_free(self.specname)
+        self.assertEqual((first.appointment, first.slot), (self.recs[0], datetime.time(8)))
+        self.assertEqual(slots.first_free(self.specname, time_from=datetime.time(9)).slot, datetime.time(10))
+        self.assertEqual(slots.first_free(self.specname, doctor=self.recs[1].doctor).appointment, self.recs[1])
+        self.assertEqual(slots.first_free(self.specname, date_from=self.later.dapp).appointment, self.later)
+        self.assertEqual(slots.claim_first(self.patient, self.specname), (slots.CLAIMED, first.pk))
+        outcome, pk = slots.claim_first(self.patient, self.specname)
+        self.assertEqual((outcome, Booking.objects.get(pk=pk).appointment), (slots.CLAIMED, self.recs[1]))
+        self.assertEqual(slots.claim_first(self.patient, self.specname, time_from=datetime.time(11)),
+                         (slots.NOT_FOUND, None))
+        self.recs[0].refresh_from_db()
+        self.assertEqual(self.recs[0].freebudget, 1)
+        plan = slots.free_tickets(self.specname, person=self.patient, time_from=datetime.time(9)).explain()
+        self.assertIn('USING INDEX appointment_free_budget_idx ', plan)
+        self.assertIn('USING INDEX booking_free_idx ', plan)
+        self.assertNotRegex(plan, r'SCAN (appointment|booking)\b')
+
+    def test_retry_taken(self):
+        original = slots.claim_ticket
+        others = []
+
+        def claim_ticket(pk, person):
+            others.append(create_doctor(f'other{len(others)}'))
+            original(pk, others[-1])
+            return original(pk, person)
+
+        with mock.patch.object(slots, 'claim_ticket', claim_ticket):
+            self.assertEqual(slots.claim_first(self.patient, self.specname, attempts=3), (slots.TAKEN, None))
+        self.assertEqual(Booking.objects.filter(person__in=others).count(), 3)
+        self.assertEqual(slots.claim_first(self.patient, self.specname)[0], slots.CLAIMED)
+
+    def test_views(self):
+        self.client.force_login(self.patient)
+        response = self.client.get(reverse('first_free'))
+        self.assertFalse(response.context['form'].is_bound)
+        self.assertNotContains(response, 'has-error')
+        params = {'specname': self.specname.pk, 'time_from': '09:00'}
+        response = self.client.get(reverse('first_free'), params)
+        self.assertEqual(response.context['ticket'].slot, datetime.time(10))
+        response = self.client.post(reverse('first_free'), params)
+        self.assertContains(response, 'забронирован для посещения на время 10:00')
+        self.assertEqual(Booking.objects.get(person=self.patient).appointment, self.recs[0])
+        response = self.client.get(reverse('first_free_api'), params)
+        self.assertEqual(response.json()['ticket']['doctor'], self.recs[1].doctor_fio())
+        self.assertEqual(self.client.post(reverse('first_free_api'), {**params, 'person': self.patient.pk}).status_code,
+                         403)
+        response = self.client.get(reverse('first_free_api'))
+        self.assertContains(response, 'specname', status_code=400)
+        registrar = User.objects.create_user('registrar', is_staff=True)
+        registrar.user_permissions.add(*Permission.objects.filter(codename__in=['view_booking', 'change_booking']))
+        self.client.force_login(registrar)
+        response = self.client.post(reverse('first_free_api'), {**params, 'person': self.patient.pk})
+        self.assertEqual(response.json()['outcome'], slots.CLAIMED)
+        self.assertEqual(response.json()['ticket']['id'], Booking.objects.get(person=self.patient,
+                                                                              appointment=self.recs[1]).pk)
+        response = self.client.post(reverse('first_free_api'), {**params, 'person': self.patient.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['ticket']['dapp'], self.later.dapp.isoformat())
+        response = self.client.post(reverse('first_free_api'), {**params, 'person': self.patient.pk})
+        self.assertEqual((response.status_code, response.json()['outcome']), (404, slots.NOT_FOUND))
+
+
+class BatchBookingTest(TestCase):
+
+    def setUp(self):
+        self.recs = create_appointments(Specialization.objects.create(specname='Терапевт'), 2)
+        self.patients = [create_doctor(f'patient{i}').pk for i in range(4)]
+        self.tickets = {(rec.pk, slot): pk for pk, rec, slot in
+                        [(pk, rec, slot) for rec in self.recs
+                         for pk, slot in Booking.objects.filter(appointment=rec).values_list('pk', 'slot')]}
+
+    def test_claim_batch(self):
+        p0, p1, p2, p3 = self.patients
+        first = self.recs[0].pk
+        items = [
+            {'person': p0, 'appointment': first},
+            {'person': p1, 'appointment': first, 'slot': datetime.time(9)},
+            {'person': p2, 'appointment': first},
+            {'person': p0, 'booking': self.tickets[first, None]},
+            {'person': p2, 'booking': self.tickets[first, datetime.time(8)]},
+            {'person': p3, 'booking': self.tickets[self.recs[1].pk, None]},
+            {'person': p3, 'booking': 0},
+        ]
+        with self.assertNumQueries(13):
+            results = slots.claim_batch(items)
+        self.assertEqual(results, [
+            (slots.CLAIMED, self.tickets[first, datetime.time(8)]),
+            (slots.CLAIMED, self.tickets[first, datetime.time(10)]), (slots.NOT_FOUND, None), (slots.DUPLICATE, None),
+            (slots.TAKEN, self.tickets[first, datetime.time(8)]),
+            (slots.CLAIMED, self.tickets[self.recs[1].pk, None]), (slots.NOT_FOUND, None),
+        ])
+        self.assertEqual(sorted(Appointment.objects.values_list('freebudget', 'freecommerce')), [(0, 1), (2, 0)])
+        with self.assertNumQueries(13):
+            results = slots.claim_batch([{'person': p2, 'appointment': rec.pk} for rec in self.recs] + [
+                {'person': p1, 'appointment': self.recs[1].pk, 'slot': datetime.time(9)},
+                {'person': p1, 'booking': self.tickets[self.recs[1].pk, None]}])
+        self.assertEqual([outcome for outcome, _ in results],
+                         [slots.NOT_FOUND, slots.CLAIMED, slots.CLAIMED, slots.TAKEN])
+        self.assertEqual(Booking.objects.filter(person=p1, slot=datetime.time(10)).count(), 2)
+
+    def test_unavailable_tickets(self):
+        past, closed = self.recs
+        Appointment.objects.filter(pk=past.pk).update(dapp=datetime.date.today() - datetime.timedelta(days=1))
+        Appointment.objects.filter(pk=closed.pk).update(is_slots=False)
+        items = [{'person': self.patients[0], 'booking': self.tickets[past.pk, datetime.time(8)]},
+                 {'person': self.patients[1], 'booking': self.tickets[closed.pk, datetime.time(8)]},
+                 {'person': self.patients[2], 'appointment': past.pk}]
+        self.assertEqual(slots.claim_batch(items), [(slots.NOT_FOUND, None)] * 3)
+        self.assertFalse(Booking.objects.filter(person__isnull=False).exists())
+
+    def test_claim_rows_conflict(self):
+        free, taken = self.tickets[self.recs[0].pk, datetime.time(8)], self.tickets[self.recs[1].pk, datetime.time(8)]
+        Booking.objects.filter(pk=taken).update(person=self.patients[0])
+        self.assertEqual(slots.claim_rows({free: self.patients[1], taken: self.patients[2]}), {free})
+        self.assertEqual(Booking.objects.get(pk=free).person_id, self.patients[1])
+
+    def test_view(self):
+        url = reverse('booking_batch_api')
+        body = {'items': [{'person': self.patients[0], 'appointment': self.recs[0].pk, 'slot': '09:00'},
+                          {'person': -1, 'appointment': self.recs[0].pk}]}
+        registrar = User.objects.create_user('registrar', is_staff=True)
+        self.client.force_login(registrar)
+        self.assertEqual(self.client.post(url, json.dumps(body), content_type='application/json').status_code, 403)
+        with self.captureOnCommitCallbacks(execute=True):
+            registrar.user_permissions.add(Permission.objects.get(codename='change_booking'))
+        response = self.client.post(url, json.dumps(body), content_type='application/json')
+        claimed, invalid = response.json()['results']
+        self.assertEqual((claimed['outcome'], claimed['ticket']['slot']), (slots.CLAIMED, '10:00'))
+        self.assertEqual(invalid['outcome'], slots.INVALID)
+        for bad in ({}, {'items': [{'person': 1}]}, {'items': [{'person': 1, 'booking': 1, 'appointment': 1}]},
+                    {'items': [{'person': 1, 'appointment': 1, 'slot': 'x'}]},
+                    {'items': [{'person': True, 'appointment': 1}]}, {'items': [{'person': 1, 'booking': True}]},
+                    {'items': [{'person': 1, 'booking': 1, 'slot': '09:00'}]}):
+            self.assertEqual(self.client.post(url, json.dumps(bad), content_type='application/json').status_code,
+                             400)
+
+
+class PermissionCacheTest(TestCase):
+
+    def setUp(self):
+        self.user = create_doctor('patient')
+        self.user.user_permissions.add(Permission.objects.get(codename='view_booking'))
+        self.group = Group.objects.create(name='Регистратура')
+
+    def has_perm(self, perm):
+        return User.objects.get(pk=self.user.pk).has_perm(perm)
+
+    def test_invalidation(self):
+        self.assertTrue(self.has_perm('registry.view_booking'))
+        user = User.objects.get(pk=self.user.pk)
+        # Одно чтение общего кэша, без запросов к таблицам прав
+        with self.assertNumQueries(1):
+            self.assertFalse(user.has_perm('registry.change_booking'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        self.assertFalse(self.has_perm('registry.change_booking'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.permissions.add(Permission.objects.get(codename='change_booking'))
+        self.assertTrue(self.has_perm('registry.change_booking'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.group.user_set.remove(self.user)
+        self.assertFalse(self.has_perm('registry.change_booking'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.user_permissions.clear()
+        self.assertFalse(self.has_perm('registry.view_booking'))
+        self.user.is_superuser = True
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertTrue(self.has_perm('registry.change_booking'))
+
+    def test_version_after_commit(self):
+        self.group.permissions.add(Permission.objects.get(codename='change_booking'))
+        self.assertFalse(self.has_perm('registry.change_booking'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user.groups.add(self.group)
+        # Версия меняется только после фиксации транзакции
+        self.assertFalse(self.has_perm('registry.change_booking'))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(self.has_perm('registry.change_booking'))
+
+    def test_keys_expire(self):
+        self.assertTrue(self.has_perm('registry.view_booking'))
+        cache = backends.get_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.groups.add(self.group)
+        *versions, key = backends.perms_keys(self.user.pk)
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT cache_key, expires FROM registry_cache')
+            expires = {cache_key: value for cache_key, value in cursor.fetchall()}
+        self.assertTrue(all(expires[cache.make_key(name)].year < 9999
+                            for name in (versions[1], key)))
+
+    def test_user_admin_groups_prefetched(self):
+        registrar = User.objects.create_user('registrar', is_staff=True)
+        registrar.user_permissions.add(Permission.objects.get(codename='view_user'))
+        self.client.force_login(registrar)
+        url = reverse('admin:auth_user_changelist')
+
+        def count_queries():
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertContains(response, 'Врачи')
+            return len(ctx.captured_queries)
+
+        count_queries()
+        expected = count_queries()
+        for i in range(5):
+            create_doctor(f'doctor{i}')
+        self.assertEqual(count_queries(), expected)
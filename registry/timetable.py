@@ -0,0 +1,55 @@
+import datetime
+from django.db import IntegrityError, transaction
+from .models import Appointment, Timetable
+from . import slots
+
+
+def insert(recs, batch_size=slots.BATCH_SIZE):
+    """
+    Вставка строк расписания пакетами. Если часть строк успели вставить параллельно (нарушение уникальности),
+    строки вставляются по одной с пропуском существующих. Возвращает фактически вставленные строки.
+    """
+    try:
+        with transaction.atomic():
+            return Appointment.objects.bulk_create(recs, batch_size=batch_size)
+    except IntegrityError:
+        pass
+    inserted = []
+    for rec in recs:
+        rec.pk = None
+        try:
+            with transaction.atomic():
+                rec.save(force_insert=True)
+        except IntegrityError:
+            continue
+        inserted.append(rec)
+    return inserted
+
+
+def materialize(date_from, date_to, queryset=None, tickets=False, batch_size=slots.BATCH_SIZE):
+    """
+    Строки расписания по действующим шаблонам за период. Дни, для которых строка (дата, специализация, врач)
+    уже есть, пропускаются, поэтому повторный запуск ничего не меняет. Возвращает количество фактически
+    вставленных строк и строки, для которых созданы талоны.
+    """
+    queryset = Timetable.objects.all() if queryset is None else queryset
+    templates = {}
+    for rec in queryset.filter(is_active=True).order_by():
+        templates.setdefault(rec.weekday, []).append(rec)
+    if not templates:
+        return 0, []
+    period = Appointment.objects.filter(dapp__range=(date_from, date_to)).order_by()
+    existing = set(period.values_list('dapp', 'specname_id', 'doctor_id'))
+    new = []
+    for day in range((date_to - date_from).days + 1):
+        dapp = date_from + datetime.timedelta(days=day)
+        new += [rec.appointment(dapp) for rec in templates.get(dapp.weekday(), [])
+                if (dapp, rec.specname_id, rec.doctor_id) not in existing]
+    new = insert(new, batch_size)
+    created = []
+    if tickets and new:
+        keys = {(rec.dapp, rec.specname_id, rec.doctor_id) for rec in new}
+        pks = [pk for pk, *key in period.filter(is_slots=False).values_list('pk', 'dapp', 'specname_id', 'doctor_id')
+               if tuple(key) in keys]
+        created = slots.create_slots(Appointment.objects.filter(pk__in=pks), batch_size=batch_size)
+    return len(new), created
@@ -4,9 +4,21 @@ from . import views
 urlpatterns = [
     path('', views.HomeView.as_view(), name='home'),
     path('appointment/', views.AppointmentListView.as_view(), name='appointment'),
+    path('calendar/', views.CalendarView.as_view(), name='calendar'),
+    path('api/schedule/', views.ScheduleApiView.as_view(), name='schedule_api'),
     path('booking/appointment/<int:pk>/', views.BookingListView.as_view(), name='booking'),
+    path('booking/appointment/<int:pk>/events/', views.BookingEventsView.as_view(), name='booking_events'),
+    path('booking/first-free/', views.FirstFreeView.as_view(), name='first_free'),
+    path('api/first-free/', views.FirstFreeApiView.as_view(), name='first_free_api'),
+    path('api/booking/batch/', views.BatchBookingApiView.as_view(), name='booking_batch_api'),
     path('booking/update/', views.BookingUserUpdate.as_view(), name='booking_user'),
+    path('booking/export/', views.BookingExportView.as_view(), name='booking_export'),
     path('booking/mybooking/', views.MyBookingListView.as_view(), name='mybooking'),
     path('person-autocomplete/', views.PersonAutocomplete.as_view(), name='select2_fk_person'),
-    path('doctor-autocomplete/', views.DoctorAutocomplete.as_view(), name='select2_fk_doctor')
+    path('doctor-autocomplete/', views.DoctorAutocomplete.as_view(), name='select2_fk_doctor'),
+    path('async/appointment/', views.AsyncAppointmentListView.as_view(), name='appointment_async'),
+    path('async/booking/appointment/<int:pk>/', views.AsyncBookingListView.as_view(), name='booking_async'),
+    path('async/booking/mybooking/', views.AsyncMyBookingListView.as_view(), name='mybooking_async'),
+    path('async/person-autocomplete/', views.AsyncPersonAutocomplete.as_view(), name='select2_fk_person_async'),
+    path('async/doctor-autocomplete/', views.AsyncDoctorAutocomplete.as_view(), name='select2_fk_doctor_async')
 ]
@@ -1,17 +1,29 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth.decorators import permission_required
-from django.db import IntegrityError
+from django.core.exceptions import PermissionDenied
 from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from django.urls import reverse_lazy
-from django.shortcuts import render, redirect, get_object_or_404
-from django.views.generic import TemplateView, ListView, UpdateView
+from django.shortcuts import render, redirect
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.views.generic import TemplateView, ListView, UpdateView, View
 from django_tables2.views import SingleTableMixin
 from django_filters.views import FilterView
 from dal import autocomplete
 from .tables import AppointmentTable, BookingTable, MyBookingTable
 from .filters import AppointmentFilter
-from .models import Appointment, Booking
-from datetime import date
+from .forms import BookingExportForm, CalendarForm, FirstFreeForm
+from .models import Appointment, ArchivedBooking, Booking, SearchKey
+from .pagination import AFTER_VAR, BEFORE_VAR, KeysetTableMixin, UnionKeysetPaginator
+from .live import slot_broker
+from . import export, schedule, slots
+from datetime import date, datetime, time, timedelta, timezone
+from itertools import chain
+import hashlib
+import json
 
 
 class HomeView(TemplateView):
@@ -31,7 +43,88 @@ class AppointmentListView(SingleTableMixin, FilterView):
         return super().dispatch(*args, **kwargs)
 
     def get_queryset(self, **kwargs):
-        return Appointment.objects.filter(is_slots=True, dapp__gte=date.today())
+        return schedule.queryset()
+
+    def get_table_data(self):
+        if self.filterset.is_bound and not self.filterset.is_valid():
+            return super().get_table_data()
+        cleaned_data = self.filterset.form.cleaned_data if self.filterset.is_bound else {}
+        return schedule.rows(cleaned_data, lambda: self.object_list)
+
+
+class CalendarView(TemplateView):
+    """Свободные талоны по специализациям на ближайшие недели (по сводке day_summary, одним запросом)."""
+    template_name = 'calendar.html'
+    extra_context = {'title': 'Календарь свободных талонов',
+                     'message': 'Количество свободных талонов по специализациям и дням приема'}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = CalendarForm(self.request.GET)
+        today = date.today()
+        start = today - timedelta(days=today.weekday())
+        weeks = []
+        if form.is_valid():
+            count = form.cleaned_data['weeks'] or getattr(settings, 'REGISTRY_CALENDAR_WEEKS', 4)
+            days = {}
+            for rec in form.get_queryset(today, start + timedelta(weeks=count, days=-1)):
+                days.setdefault(rec.dapp, []).append(rec)
+            for week in range(count):
+                monday = start + timedelta(weeks=week)
+                weeks.append([{'dapp': dapp, 'past': dapp < today, 'summary': days.get(dapp, [])}
+                              for dapp in (monday + timedelta(days=day) for day in range(7))])
+        context.update(form=form, weeks=weeks)
+        return context
+
+
+def schedule_stamp(request):
+    # Версия читается из общего кэша один раз на запрос: ее используют и ETag, и Last-Modified
+    if not hasattr(request, '_schedule_stamp'):
+        try:
+            dapp = date.fromisoformat(request.GET.get('dapp', ''))
+        except ValueError:
+            dapp = None
+        request._schedule_stamp = schedule.version(dapp)
+    return request._schedule_stamp
+
+
+def schedule_etag(request, *args, **kwargs):
+    key = repr((sorted(request.GET.lists()), date.today().isoformat(), schedule_stamp(request)))
+    return f'"{hashlib.md5(key.encode()).hexdigest()}"'
+
+
+def schedule_last_modified(request, *args, **kwargs):
+    # Версия - целое число секунд (schedule.touch); пока расписание дня не менялось, Last-Modified не отдается
+    stamp = schedule_stamp(request)
+    return datetime.fromtimestamp(stamp, tz=timezone.utc) if stamp else None
+
+
+class ScheduleApiView(View):
+    """Расписание приема в JSON для киосков и информационных экранов.
+
+    ETag и Last-Modified вычисляются по версии расписания дня из общего для процессов кэша (без запросов
+    к таблицам расписания), поэтому повторный запрос без изменений получает 304 Not Modified.
+    """
+
+    @method_decorator(condition(etag_func=schedule_etag, last_modified_func=schedule_last_modified))
+    def get(self, request, *args, **kwargs):
+        filterset = AppointmentFilter(request.GET or None, queryset=schedule.queryset(),
+                                      request=request)
+        if filterset.is_bound and not filterset.is_valid():
+            return JsonResponse({'errors': filterset.errors.get_json_data()}, status=400)
+        cleaned_data = filterset.form.cleaned_data if filterset.is_bound else {}
+        results = [{
+            'id': rec.pk,
+            'dapp': rec.dapp,
+            'specname': rec.specname.specname,
+            'doctor': rec.doctor_fio(),
+            'room': rec.room,
+            'appbegin': rec.appbegin,
+            'append': rec.append,
+            'freebudget': rec.freebudget,
+            'freecommerce': rec.freecommerce,
+        } for rec in schedule.rows(cleaned_data, lambda: filterset.qs)]
+        return JsonResponse({'results': results}, json_dumps_params={'ensure_ascii': False})
 
 
 class BookingListView(SingleTableMixin, ListView):
@@ -44,7 +137,8 @@ class BookingListView(SingleTableMixin, ListView):
         return super().dispatch(*args, **kwargs)
 
     def get_queryset(self, **kwargs):
-        return Booking.objects.filter(appointment=self.kwargs['pk'], person__isnull=True).exclude(slot__isnull=True)
+        return Booking.objects.filter(appointment=self.kwargs['pk'], person__isnull=True).\
+            exclude(slot__isnull=True).order_by('slot')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -55,17 +149,31 @@ class BookingListView(SingleTableMixin, ListView):
         return context
 
 
-class MyBookingListView(SingleTableMixin, ListView):
+class MyBookingListView(KeysetTableMixin, SingleTableMixin, ListView):
     table_class = MyBookingTable
     template_name = 'appointmentview.html'
     extra_context = {'title': 'Мои бронирования посещений'}
+    keyset = ('-appointment__dapp', '-appointment__specname_id', '-appointment__doctor_id', 'id')
 
     @method_decorator(permission_required('registry.view_booking', raise_exception=True))
     def dispatch(self, *args, **kwargs):
         return super().dispatch(*args, **kwargs)
 
     def get_queryset(self, **kwargs):
-        return Booking.objects.filter(person=self.request.user)
+        return Booking.objects.filter(person=self.request.user).select_related('appointment__specname')
+
+    def get_archive_queryset(self):
+        return ArchivedBooking.objects.filter(person=self.request.user).select_related('appointment__specname')
+
+    def get_keyset_paginator(self, data):
+        return UnionKeysetPaginator([data, self.get_archive_queryset()], self.keyset,
+                                    self.paginate_by or self.keyset_per_page)
+
+    def get_table_data(self):
+        data = super().get_table_data()
+        if self.keyset_page is None:
+            return list(chain(data, self.get_archive_queryset()))
+        return data
 
 
 class BookingUserUpdate(UpdateView):
@@ -74,28 +182,21 @@ class BookingUserUpdate(UpdateView):
     def dispatch(self, request, *args, **kwargs):
         return super().dispatch(request, *args, **kwargs)
 
-    def get_object(self, queryset=None):
-        return get_object_or_404(Booking.objects.select_for_update(), pk=self.request.POST.getlist('reserve')[0])
-
     def post(self, request, *args, **kwargs):
         if request.POST.get('action') == 'done':
-            self.object = self.get_object()
-            if self.object.person is None:
-                self.object.person = self.request.user
-                try:
-                    self.object.save()
-                except IntegrityError:
-                    mess = 'Невозможно провести бронирование! Возможно, что такой талон у Вас уже есть.'
-                else:
-                    mess = (
-                        f'{self.object.person.first_name} {self.object.person.profile.patronymic}! '
-                        f'{self.object} забронирован для посещения на время {self.object.slot:%H:%M}.'
-                    )
-                finally:
-                    return render(request, 'booking_info.html', {'mess': mess, 'back': self.get_success_url()})
+            pk = request.POST.getlist('reserve')[0]
+            outcome = slots.claim_ticket(pk, request.user)
+            if outcome == slots.CLAIMED:
+                self.object = Booking.objects.select_related('appointment__specname').get(pk=pk)
+                mess = (
+                    f'{request.user.first_name} {request.user.profile.patronymic}! '
+                    f'{self.object} забронирован для посещения на время {self.object.slot:%H:%M}.'
+                )
+            elif outcome == slots.DUPLICATE:
+                mess = 'Невозможно провести бронирование! Возможно, что такой талон у Вас уже есть.'
             else:
                 mess = 'Время, выбранное Вами уже занято! Попробуйте другое.'
-                return render(request, 'booking_info.html', {'mess': mess, 'back': self.get_success_url()})
+            return render(request, 'booking_info.html', {'mess': mess, 'back': self.get_success_url()})
         else:
             return redirect(self.get_success_url())
 
@@ -105,33 +206,319 @@ class BookingUserUpdate(UpdateView):
         return self.request.session['back_for_booking']
 
 
-class PersonAutocomplete(autocomplete.Select2QuerySetView):
+class BookingExportView(View):
+
+    @method_decorator(staff_member_required)
+    @method_decorator(permission_required('registry.view_booking', raise_exception=True))
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        form = BookingExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        response = export.FORMATS.get(form.cleaned_data['format'] or 'csv')
+        if response is None:
+            return HttpResponseBadRequest('Формат недоступен')
+        data = form.cleaned_data
+        return response(form.get_queryset(), f'booking_{data["date_from"]:%Y%m%d}_{data["date_to"]:%Y%m%d}', request)
+
+
+def ticket_data(rec):
+    appointment = rec.appointment
+    return {'id': rec.pk, 'dapp': appointment.dapp.isoformat(), 'slot': f'{rec.slot:%H:%M}' if rec.slot else None,
+            'specname': appointment.specname.specname, 'doctor': appointment.doctor_fio(), 'room': appointment.room}
+
+
+class FirstFreeMixin:
+    """
+    Первый свободный бюджетный талон специализации: GET - поиск, POST - бронирование первого свободного
+    на момент запроса талона. Регистратор (is_staff) может бронировать для посетителя person.
+    """
+
+    @method_decorator(permission_required('registry.view_booking', raise_exception=True))
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def get_form(self):
+        return FirstFreeForm(self.request.POST if self.request.method == 'POST' else self.request.GET or None)
+
+    def get_person(self, form):
+        person = form.cleaned_data['person']
+        if person is None:
+            return self.request.user
+        if not self.request.user.is_staff:
+            raise PermissionDenied
+        return person
+
+    def find(self, form):
+        return slots.first_free(form.cleaned_data['specname'], person=self.get_person(form), **form.search_params())
+
+    def claim(self, form):
+        if not self.request.user.has_perm('registry.change_booking'):
+            raise PermissionDenied
+        person = self.get_person(form)
+        outcome, pk = slots.claim_first(person, form.cleaned_data['specname'], **form.search_params())
+        ticket = Booking.objects.select_related('appointment__specname').get(pk=pk) if outcome == slots.CLAIMED \
+            else None
+        return outcome, person, ticket
+
+
+class FirstFreeView(FirstFreeMixin, TemplateView):
+    template_name = 'first_free.html'
+    extra_context = {'title': 'Первый свободный талон',
+                     'message': 'Ближайшее свободное время приема врачей выбранной специализации'}
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        form = self.get_form()
+        context.update(form=form, ticket=self.find(form) if form.is_bound and form.is_valid() else None)
+        return context
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return self.render_to_response(self.get_context_data())
+        outcome, person, ticket = self.claim(form)
+        if outcome == slots.CLAIMED:
+            mess = (
+                f'{person.first_name} {person.profile.patronymic}! '
+                f'{ticket} забронирован для посещения на время {ticket.slot:%H:%M}.'
+            )
+        elif outcome == slots.DUPLICATE:
+            mess = 'Невозможно провести бронирование! Возможно, что такой талон у Вас уже есть.'
+        elif outcome == slots.NOT_FOUND:
+            mess = 'Свободных талонов с заданными условиями нет.'
+        else:
+            mess = 'Свободные талоны успели забронировать другие посетители! Попробуйте еще раз.'
+        return render(request, 'booking_info.html', {'mess': mess, 'back': reverse_lazy('first_free')})
+
+
+class FirstFreeApiView(FirstFreeMixin, View):
+    """Первый свободный талон в JSON (GET) и его бронирование (POST) для рабочего места регистратора."""
+    statuses = {slots.CLAIMED: 200, slots.NOT_FOUND: 404, slots.TAKEN: 409, slots.DUPLICATE: 409}
+
+    def get(self, request, *args, **kwargs):
+        # Без параметров поиска API отвечает ошибкой с перечнем обязательных полей
+        form = FirstFreeForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        ticket = self.find(form)
+        return JsonResponse({'ticket': ticket_data(ticket) if ticket else None},
+                            json_dumps_params={'ensure_ascii': False})
+
+    def post(self, request, *args, **kwargs):
+        form = self.get_form()
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        outcome, person, ticket = self.claim(form)
+        return JsonResponse({'outcome': outcome, 'person': person.pk,
+                             'ticket': ticket_data(ticket) if ticket else None},
+                            status=self.statuses[outcome], json_dumps_params={'ensure_ascii': False})
+
+
+def is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+class BatchBookingApiView(View):
+    """
+    Пакетное бронирование для регистратуры (прививочная кампания, перенос посетителей отмененного приема).
+    Тело запроса - JSON {"items": [{"person": код, "booking": код} | {"person": код, "appointment": код,
+    "slot": "ЧЧ:ММ"}, ...]}, результат - по каждому элементу в том же порядке.
+    """
+    limit = 500
+
+    @method_decorator(staff_member_required)
+    @method_decorator(permission_required('registry.change_booking', raise_exception=True))
+    def dispatch(self, *args, **kwargs):
+        return super().dispatch(*args, **kwargs)
+
+    def parse(self, body):
+        items = json.loads(body)['items']
+        if not isinstance(items, list) or len(items) > self.limit:
+            raise ValueError(f'Ожидается список не более чем из {self.limit} элементов')
+        result = []
+        for item in items:
+            person, booking, appointment, slot = map(item.get, ('person', 'booking', 'appointment', 'slot'))
+            # bool - подкласс int, но кодом не является; время задается только для строки расписания
+            if not is_id(person) or (booking is None) == (appointment is None) or \
+                    not is_id(appointment if booking is None else booking) or booking is not None and slot is not None:
+                raise ValueError(f'Неверный элемент: {item}')
+            result.append({'person': person, 'booking': booking, 'appointment': appointment,
+                           'slot': time.fromisoformat(slot) if slot else None})
+        return result
+
+    def post(self, request, *args, **kwargs):
+        try:
+            items = self.parse(request.body)
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            return HttpResponseBadRequest(str(e))
+        persons = set(User.objects.filter(pk__in={item['person'] for item in items}, is_staff=False).
+                      values_list('pk', flat=True))
+        valid = [i for i, item in enumerate(items) if item['person'] in persons]
+        results = [(slots.INVALID, None)] * len(items)
+        for i, result in zip(valid, slots.claim_batch([items[i] for i in valid])):
+            results[i] = result
+        tickets = Booking.objects.select_related('appointment__specname').\
+            in_bulk([pk for outcome, pk in results if outcome == slots.CLAIMED])
+        return JsonResponse({'results': [
+            {'person': item['person'], 'outcome': outcome, 'booking': pk,
+             'ticket': ticket_data(tickets[pk]) if pk in tickets else None}
+            for item, (outcome, pk) in zip(items, results)
+        ]}, json_dumps_params={'ensure_ascii': False})
+
+
+class UserAutocompleteMixin:
+
+    def search(self, queryset):
+        queryset = queryset.select_related('profile').order_by('searchkey__key')
+        if self.q:
+            key = SearchKey.normalize(self.q)
+            queryset = queryset.filter(searchkey__key__gte=key, searchkey__key__lt=key + '\U0010ffff')
+        return queryset
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        results = list(queryset[(page - 1) * page_size:page * page_size + 1])
+        self.more = len(results) > page_size
+        return None, None, results[:page_size], self.more
+
+    def has_more(self, context):
+        return self.more
+
+
+class PersonAutocomplete(UserAutocompleteMixin, autocomplete.Select2QuerySetView):
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return User.objects.none()
         qs = User.objects.filter(is_staff=False, is_active=True, groups__name='Посетители').\
-            exclude(first_name='').exclude(last_name='').exclude(profile__birth_date__isnull=True).\
-            order_by('last_name', 'first_name')
-        if self.q:
-            qs = qs.filter(last_name__istartswith=self.q)
-        return qs
+            exclude(first_name='').exclude(last_name='').exclude(profile__birth_date__isnull=True)
+        return self.search(qs)
 
     def get_result_label(self, result):
         return f'{result.last_name} {result.first_name} {result.profile.patronymic} ({result.profile.birth_date:%d.%m.%Y})'
 
 
-class DoctorAutocomplete(autocomplete.Select2QuerySetView):
+class DoctorAutocomplete(UserAutocompleteMixin, autocomplete.Select2QuerySetView):
 
     def get_queryset(self):
         if not self.request.user.is_authenticated:
             return User.objects.none()
         qs = User.objects.filter(is_staff=False, is_active=True, groups__name='Врачи').\
-            exclude(first_name='').exclude(last_name='').\
-            order_by('last_name', 'first_name')
-        if self.q:
-            qs = qs.filter(last_name__istartswith=self.q)
-        return qs
+            exclude(first_name='').exclude(last_name='')
+        return self.search(qs)
 
     def get_result_label(self, result):
         return f'{result.last_name} {result.first_name} {result.profile.patronymic}'
+
+
+# Асинхронные варианты представлений (ASGI): запросы к базе - через асинхронный ORM,
+# шаблоны те же, TemplateResponse отрисовывается обработчиком Django.
+
+class AsyncPermissionMixin:
+    permission_required = None
+
+    async def authorize(self, request):
+        request.user = await request.auser()
+        if self.permission_required and not await sync_to_async(request.user.has_perm)(self.permission_required):
+            raise PermissionDenied
+        return request.user
+
+
+class AsyncAppointmentListView(SingleTableMixin, TemplateView):
+    table_class = AppointmentTable
+    template_name = AppointmentListView.template_name
+    extra_context = AppointmentListView.extra_context
+
+    async def get(self, request, *args, **kwargs):
+        request.session['back_for_booking'] = request.get_full_path()
+        filterset = AppointmentFilter(request.GET or None, queryset=schedule.queryset(),
+                                      request=request)
+        self.object_list = []
+        if not filterset.is_bound or await sync_to_async(filterset.is_valid)():
+            cleaned_data = filterset.form.cleaned_data if filterset.is_bound else {}
+            self.object_list = await schedule.arows(cleaned_data, filterset.qs)
+        return self.render_to_response(self.get_context_data(filter=filterset, object_list=self.object_list))
+
+
+class AsyncBookingListView(AsyncPermissionMixin, SingleTableMixin, TemplateView):
+    table_class = BookingTable
+    template_name = BookingListView.template_name
+    extra_context = BookingListView.extra_context
+    permission_required = 'registry.view_booking'
+
+    async def get(self, request, *args, **kwargs):
+        await self.authorize(request)
+        self.object_list = [rec async for rec in BookingListView.get_queryset(self)]
+        context = self.get_context_data(object_list=self.object_list)
+        if not request.session.get('back_for_booking'):
+            request.session['back_for_booking'] = request.META.get('HTTP_REFERER', '/')
+        context['previous_url'] = request.session['back_for_booking']
+        context['message'] = await Appointment.objects.select_related('specname').aget(pk=self.kwargs['pk'])
+        return self.render_to_response(context)
+
+
+class BookingEventsView(AsyncPermissionMixin, View):
+    """Поток server-sent events со свободными талонами строки расписания (только ASGI)."""
+    permission_required = 'registry.view_booking'
+
+    async def get(self, request, *args, **kwargs):
+        await self.authorize(request)
+        if not hasattr(request, 'scope'):
+            return HttpResponse(status=204)
+        response = StreamingHttpResponse(slot_broker.stream(self.kwargs['pk']), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class AsyncMyBookingListView(AsyncPermissionMixin, KeysetTableMixin, SingleTableMixin, TemplateView):
+    table_class = MyBookingTable
+    template_name = MyBookingListView.template_name
+    extra_context = MyBookingListView.extra_context
+    keyset = MyBookingListView.keyset
+    permission_required = 'registry.view_booking'
+
+    async def get(self, request, *args, **kwargs):
+        await self.authorize(request)
+        querysets = [MyBookingListView.get_queryset(self), MyBookingListView.get_archive_queryset(self)]
+        if self.keyset_enabled():
+            paginator = UnionKeysetPaginator(querysets, self.keyset, self.keyset_per_page)
+            self.keyset_page = await paginator.apage(request.GET.get(AFTER_VAR), request.GET.get(BEFORE_VAR))
+            self.object_list = self.keyset_page.object_list
+        else:
+            self.object_list = [rec for queryset in querysets async for rec in queryset]
+        return self.render_to_response(self.get_context_data(object_list=self.object_list))
+
+    def get_table_data(self):
+        return self.object_list
+
+
+class AsyncUserAutocompleteMixin(UserAutocompleteMixin):
+    http_method_names = ['get']
+
+    async def get(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        page_size = self.get_paginate_by(None)
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        queryset = self.get_queryset()[(page - 1) * page_size:page * page_size + 1]
+        results = [result async for result in queryset]
+        self.more = len(results) > page_size
+        self.object_list = results[:page_size]
+        return self.render_to_response({'object_list': self.object_list, 'page_obj': None})
+
+
+class AsyncPersonAutocomplete(AsyncUserAutocompleteMixin, PersonAutocomplete):
+    pass
+
+
+class AsyncDoctorAutocomplete(AsyncUserAutocompleteMixin, DoctorAutocomplete):
+    pass